@@ -19,11 +19,11 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import os
-import queue
 import sys
 
 import yaml
 
+from library.lcd.update_queue import UpdateQueue
 from library.log import logger
 
 
@@ -96,4 +96,5 @@ def load_theme():
 load_theme()
 
 # Queue containing the serial requests to send to the screen
-update_queue = queue.Queue()
+# Pending bitmaps are replaced by newer ones for the same display region, so that the queue cannot grow without limit
+update_queue = UpdateQueue()
@@ -16,6 +16,8 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+from PIL import ImageFont
+
 from library import config
 from library.lcd.lcd_comm import Orientation
 from library.lcd.lcd_comm_rev_a import LcdCommRevA
@@ -75,6 +77,30 @@ class Display:
         else:
             logger.error("Unknown display revision '", config.CONFIG_DATA["display"]["REVISION"], "'")
 
+        # Theme images converted to the display pixel format can be stored on disk to speed up next startups
+        if config.CONFIG_DATA["display"].get("BITMAP_CACHE_DIR", ""):
+            self.lcd.bitmap_cache.cache_dir = config.CONFIG_DATA["display"]["BITMAP_CACHE_DIR"]
+
+        # Only send the pixels that have changed since the last update
+        if config.CONFIG_DATA["display"].get("SHADOW_FRAMEBUFFER", False):
+            self.lcd.EnableShadowFramebuffer()
+
+        # Number of rendered texts kept in memory, see the cache statistics logged on exit to size it for a theme
+        if config.CONFIG_DATA["display"].get("TEXT_CACHE_SIZE", 0):
+            self.lcd.text_cache.max_entries = config.CONFIG_DATA["display"]["TEXT_CACHE_SIZE"]
+
+        # Texts can be blended directly in the RGB565 pixel format of the display: faster, but not pixel-exact
+        if config.CONFIG_DATA["display"].get("RGB565_TEXT_BLENDING", False):
+            self.lcd.rgb565_text_blending = True
+
+        # Themes that do not need complex text shaping can use the faster basic text layout engine
+        if config.THEME_DATA["display"].get("FONT_LAYOUT_ENGINE", "") == "basic":
+            self.lcd.font_layout_engine = ImageFont.Layout.BASIC
+
+        # Draw widgets into an in-memory canvas of the screen, and send the updated regions together at each flush
+        if config.CONFIG_DATA["display"].get("FRAME_COMPOSITION", False):
+            self.lcd.EnableFrameComposition()
+
     def initialize_display(self):
         # Reset screen in case it was in an unstable state (screen is also cleared)
         self.lcd.Reset()
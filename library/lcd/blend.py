@@ -0,0 +1,119 @@
+# turing-smart-screen-python - a Python system monitor and library for 3.5" USB-C displays like Turing Smart Screen or XuanFang
+# https://github.com/mathoudebine/turing-smart-screen-python/
+
+# Copyright (C) 2021-2023  Matthieu Houdebine (mathoudebine)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# This file blends texts directly in the RGB565 pixel format: background images are converted once to RGB565 planes,
+# texts are rendered as 8-bit coverage masks, and the text color is blended over the background in RGB565.
+# Compared to blending in RGB888 then converting, the result can differ by one RGB565 level on antialiased pixels
+# Requires NumPy
+
+import functools
+import threading
+from typing import Tuple
+
+from PIL import Image
+
+from library.lcd.cache import get_background_image
+from library.lcd.codec import PixelFormat
+
+# NumPy is optional: without it, texts are always blended in RGB888
+try:
+    import numpy as np
+except:
+    np = None
+
+# Serialization of 16-bit pixels for each supported pixel format
+RGB565_DTYPES = {
+    PixelFormat.RGB565_LE: "<u2",
+    PixelFormat.RGB565_BE: ">u2",
+}
+
+# RGB565 planes of background images: image path -> (decoded image, plane)
+_background_planes = {}
+_background_planes_mutex = threading.Lock()
+
+
+def is_supported(pixel_format: PixelFormat) -> bool:
+    return np is not None and pixel_format in RGB565_DTYPES
+
+
+def _to_RGB565(rgb):
+    # Convert an array of R, G, B channels (last axis) to RGB565 values
+    rgb = rgb.astype(np.uint16)
+    return ((rgb[..., 0] >> 3) << 11) | ((rgb[..., 1] >> 2) << 5) | (rgb[..., 2] >> 3)
+
+
+def get_background_plane(image_path: str):
+    # Return the RGB565 values of a background image, as an array of height x width 16-bit values
+    # Plane is converted again if the background image file has been modified
+    image = get_background_image(image_path)
+
+    with _background_planes_mutex:
+        entry = _background_planes.get(image_path)
+
+    if entry is None or entry[0] is not image:
+        entry = (image, _to_RGB565(np.asarray(image)))
+        with _background_planes_mutex:
+            _background_planes[image_path] = entry
+
+    return entry[1]
+
+
+@functools.lru_cache(maxsize=64)
+def _get_blend_tables(color: Tuple[int, int, int]):
+    # Lookup tables giving the blended R, G, B parts of RGB565 pixels (already shifted at their position),
+    # indexed by (background channel value << 8) | coverage
+    # Each channel is interpolated in its own precision (5/6/5 bits), with rounding
+    coverage = np.arange(256, dtype=np.int32)
+    tables = []
+    for (shift, bits, value) in ((11, 5, color[0]), (5, 6, color[1]), (0, 5, color[2])):
+        channel = np.arange(1 << bits, dtype=np.int32)[:, np.newaxis]
+        foreground = value >> (8 - bits)
+        tables.append(((channel + ((foreground - channel) * coverage + 127) // 255) << shift).astype(np.uint16).ravel())
+    return tables
+
+
+def blend_mask_RGB565(background, mask: Image, color: Tuple[int, int, int]):
+    # Blend a color over RGB565 background values, with the coverage of each pixel in an 8-bit mask of the same size
+    (r_table, g_table, b_table) = _get_blend_tables(tuple(color))
+    coverage = np.asarray(mask).astype(np.uint16)
+    return (r_table.take(((background >> 11) << 8) | coverage) |
+            g_table.take((((background >> 5) & 63) << 8) | coverage) |
+            b_table.take(((background & 31) << 8) | coverage))
+
+
+def blend_text_RGB565(mask: Image, color: Tuple[int, int, int], pixel_format: PixelFormat, x: int, y: int,
+                      background_color: Tuple[int, int, int] = None, background_image: str = None,
+                      rotate_180: bool = False) -> memoryview:
+    # Return the bitmap of a text in the display pixel format, from its coverage mask displayed at (x, y)
+    # over a solid color or over the provided background image
+    (width, height) = mask.size
+    if background_image is None:
+        background = np.full((height, width), _to_RGB565(np.array(background_color, dtype=np.uint8)),
+                             dtype=np.uint16)
+    else:
+        plane = get_background_plane(background_image)
+        # Parts outside of the background image are black, as with the cropped background image
+        background = np.zeros((height, width), dtype=np.uint16)
+        visible = plane[y:y + height, x:x + width]
+        background[:visible.shape[0], :visible.shape[1]] = visible
+
+    result = blend_mask_RGB565(background, mask, color)
+    if rotate_180:
+        result = result[::-1, ::-1]
+
+    return memoryview(result.astype(RGB565_DTYPES[pixel_format])).cast("B")
@@ -0,0 +1,232 @@
+# turing-smart-screen-python - a Python system monitor and library for 3.5" USB-C displays like Turing Smart Screen or XuanFang
+# https://github.com/mathoudebine/turing-smart-screen-python/
+
+# Copyright (C) 2021-2023  Matthieu Houdebine (mathoudebine)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# This file contains caches used to avoid decoding/converting the same images again and again
+
+import functools
+import hashlib
+import mmap
+import os
+import struct
+import threading
+from collections import OrderedDict
+from typing import Tuple
+
+from PIL import Image, ImageFont
+
+from library.lcd.codec import get_codec
+from library.log import logger
+
+# Header of bitmap cache files: source file modification time (ns), source file size, bitmap width, bitmap height
+BITMAP_HEADER = struct.Struct("<qqHH")
+
+# Maximum number of loaded fonts kept in memory
+FONT_CACHE_SIZE = 32
+
+
+@functools.lru_cache(maxsize=FONT_CACHE_SIZE)
+def get_font(font_path: str, font_size: int, layout_engine: ImageFont.Layout = None) -> ImageFont.FreeTypeFont:
+    # Load a font once and share it between all threads, instead of parsing the font file at each text refresh
+    # The cache is thread-safe and bounded: least recently used fonts are evicted when it is full
+    # Use get_font.cache_info() to get the cache hits/misses counters
+    return ImageFont.truetype(font_path, font_size, layout_engine=layout_engine)
+
+
+# Decoded background images: image path -> (file modification time, RGB image)
+_background_images = {}
+_background_images_mutex = threading.Lock()
+
+
+def get_background_image(image_path: str) -> Image.Image:
+    # Return the decoded RGB content of an image used as background for texts and progress bars
+    # Image file is only decoded again if it has been modified
+    # Returned image is shared by all threads and must not be modified: crop it to get a copy of the needed part
+    mtime = os.stat(image_path).st_mtime_ns
+
+    with _background_images_mutex:
+        entry = _background_images.get(image_path)
+
+    if entry is None or entry[0] != mtime:
+        with Image.open(image_path) as image:
+            entry = (mtime, image.convert("RGB"))
+        with _background_images_mutex:
+            _background_images[image_path] = entry
+
+    return entry[1]
+
+
+class BitmapCache:
+    # Bitmaps converted to the display pixel format, kept in memory and optionally on disk
+    # On disk, each bitmap is stored in its own file, that is memory-mapped when read
+    def __init__(self, cache_dir: str = None):
+        # Directory where converted bitmaps are stored. If None, bitmaps are only kept in memory
+        self.cache_dir = cache_dir
+
+        # Converted bitmaps: asset key -> (source file version, data, width, height)
+        self.bitmaps = {}
+        self.mutex = threading.Lock()
+
+    def get(self, lcd, bitmap_path: str, x: int = 0, y: int = 0, width: int = 0,
+            height: int = 0) -> Tuple[bytes, int, int]:
+        # Return the bitmap converted for this display, with its final width/height
+        # Bitmap is only decoded and converted if it is not in cache, or if the file has changed
+        stat = os.stat(bitmap_path)
+        version = (stat.st_mtime_ns, stat.st_size)
+        asset_key = (os.path.abspath(bitmap_path), width, height, int(lcd.orientation), type(lcd).__name__,
+                     lcd.display_width, lcd.display_height)
+
+        with self.mutex:
+            entry = self.bitmaps.get(asset_key)
+
+        if entry is None or entry[0] != version:
+            entry = None
+            if self.cache_dir:
+                entry = self._load(asset_key, version, get_codec(lcd.PIXEL_FORMAT).bytes_per_pixel)
+
+            if entry is None:
+                image = lcd.CropImage(Image.open(bitmap_path), x, y, width, height)
+                entry = (version, lcd.EncodeImage(image), image.size[0], image.size[1])
+                if self.cache_dir:
+                    self._store(asset_key, entry)
+
+            with self.mutex:
+                self.bitmaps[asset_key] = entry
+
+        return entry[1], entry[2], entry[3]
+
+    def clear(self):
+        with self.mutex:
+            self.bitmaps.clear()
+
+    def _get_file_path(self, asset_key) -> str:
+        return os.path.join(self.cache_dir, hashlib.sha1(repr(asset_key).encode("utf-8")).hexdigest() + ".bin")
+
+    def _load(self, asset_key, version, bytes_per_pixel: int):
+        try:
+            with open(self._get_file_path(asset_key), "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            # File does not exist (yet) or is empty
+            return None
+
+        try:
+            mtime, size, width, height = BITMAP_HEADER.unpack_from(mapped)
+        except struct.error:
+            return None
+
+        if (mtime, size) != version:
+            # Source file has changed since the bitmap was converted
+            return None
+
+        if len(mapped) - BITMAP_HEADER.size != width * height * bytes_per_pixel:
+            # Truncated or corrupted file: bitmap is converted again
+            return None
+
+        return version, memoryview(mapped)[BITMAP_HEADER.size:], width, height
+
+    def _store(self, asset_key, entry):
+        version, data, width, height = entry
+        file_path = self._get_file_path(asset_key)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(file_path + ".tmp", "wb") as f:
+                f.write(BITMAP_HEADER.pack(version[0], version[1], width, height))
+                f.write(data)
+            os.replace(file_path + ".tmp", file_path)
+        except OSError as e:
+            logger.warning("Cannot write bitmap cache file %s: %s" % (file_path, str(e)))
+
+
+class ImagePool:
+    # Scratch images reused from one rendering to the next, instead of allocating a new image at each refresh
+    # An image must be released once its content has been converted/copied, so that it can be acquired again
+    def __init__(self, max_sizes: int = 64, max_images_per_size: int = 4):
+        self.max_sizes = max_sizes
+        self.max_images_per_size = max_images_per_size
+
+        # Free images: (mode, size) -> list of images
+        self.images = {}
+        self.mutex = threading.Lock()
+
+    def acquire(self, mode: str, size: Tuple[int, int], color) -> Image.Image:
+        # Return an image of the requested mode and size, filled with color
+        with self.mutex:
+            free_images = self.images.get((mode, size))
+            image = free_images.pop() if free_images else None
+
+        if image is None:
+            return Image.new(mode, size, color)
+
+        image.paste(color, (0, 0, size[0], size[1]))
+        return image
+
+    def release(self, image: Image.Image):
+        key = (image.mode, image.size)
+        with self.mutex:
+            if key not in self.images and len(self.images) >= self.max_sizes:
+                # Too many different sizes (e.g. texts of variable width): start again with an empty pool
+                self.images.clear()
+            free_images = self.images.setdefault(key, [])
+            if len(free_images) < self.max_images_per_size:
+                free_images.append(image)
+
+
+class RenderedTextCache:
+    # Texts already rendered and converted to the display pixel format: text and style -> (data, width, height)
+    # Bounded LRU cache: least recently displayed texts are evicted when it is full
+    def __init__(self, max_entries: int = 512):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.mutex = threading.Lock()
+
+        # Statistics, used to size the cache for a theme (see cache_info)
+        self.hits = 0
+        self.misses = 0
+        self.data_size = 0
+
+    def get(self, key):
+        with self.mutex:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.entries.move_to_end(key)
+            return entry
+
+    def put(self, key, entry):
+        with self.mutex:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.data_size -= len(previous[0])
+            self.entries[key] = entry
+            self.data_size += len(entry[0])
+
+            while len(self.entries) > self.max_entries:
+                _, evicted = self.entries.popitem(last=False)
+                self.data_size -= len(evicted[0])
+
+    def clear(self):
+        with self.mutex:
+            self.entries.clear()
+            self.data_size = 0
+
+    def cache_info(self) -> dict:
+        with self.mutex:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self.entries),
+                    "max_entries": self.max_entries, "data_size": self.data_size}
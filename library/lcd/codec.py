@@ -0,0 +1,65 @@
+# turing-smart-screen-python - a Python system monitor and library for 3.5" USB-C displays like Turing Smart Screen or XuanFang
+# https://github.com/mathoudebine/turing-smart-screen-python/
+
+# Copyright (C) 2021-2023  Matthieu Houdebine (mathoudebine)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# This file is the registry of pixel codecs: each LcdComm revision declares the pixel format used on its link,
+# and all revisions share the same conversion code for this format (see serialize.py)
+
+from enum import Enum
+from typing import Callable
+
+from PIL import Image
+
+from library.lcd.serialize import image_to_RGB565, image_to_RGB888
+
+
+class PixelFormat(Enum):
+    RGB565_LE = "RGB565_LE"  # 0bRRRRRGGGGGGBBBBB, little-endian (HW revision A)
+    RGB565_BE = "RGB565_BE"  # 0bgggBBBBBRRRRRGGG once serialized, same as RGB565 big-endian (HW revision B)
+    RGB888 = "RGB888"  # Raw RGB pixels (simulated display)
+
+
+class PixelCodec:
+    def __init__(self, pixel_format: PixelFormat, bytes_per_pixel: int,
+                 encode_function: Callable[[Image.Image, bool], memoryview]):
+        self.pixel_format = pixel_format
+        self.bytes_per_pixel = bytes_per_pixel
+        self.encode_function = encode_function
+
+    def encode(self, image: Image, rotate_180: bool = False) -> memoryview:
+        # Convert a PIL image to a stream of pixels in this format
+        # rotate_180 is used by revisions that manage reverse orientations in software
+        return self.encode_function(image, rotate_180)
+
+
+CODECS = {}
+
+
+def register_codec(codec: PixelCodec):
+    CODECS[codec.pixel_format] = codec
+
+
+def get_codec(pixel_format: PixelFormat) -> PixelCodec:
+    return CODECS[pixel_format]
+
+
+register_codec(PixelCodec(PixelFormat.RGB565_LE, 2,
+                          lambda image, rotate_180: image_to_RGB565(image, "little", rotate_180)))
+register_codec(PixelCodec(PixelFormat.RGB565_BE, 2,
+                          lambda image, rotate_180: image_to_RGB565(image, "big", rotate_180)))
+register_codec(PixelCodec(PixelFormat.RGB888, 3,
+                          lambda image, rotate_180: image_to_RGB888(image, rotate_180)))
@@ -0,0 +1,81 @@
+# turing-smart-screen-python - a Python system monitor and library for 3.5" USB-C displays like Turing Smart Screen or XuanFang
+# https://github.com/mathoudebine/turing-smart-screen-python/
+
+# Copyright (C) 2021-2023  Matthieu Houdebine (mathoudebine)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# This file contains a frame compositor for retained-mode rendering: widgets are drawn into an in-memory canvas of the
+# whole screen, and the regions that have been drawn since the last flush are sent together to the display
+
+import threading
+from typing import List, Tuple
+
+from PIL import Image
+
+from library.lcd.rect_planner import CostModel, contains, merge_rectangles
+
+
+class FrameCompositor:
+    def __init__(self, width: int, height: int, orientation: int = 0):
+        # Canvas size and orientation are the ones of the screen as seen by widgets (before software reverse)
+        self.width = width
+        self.height = height
+        self.orientation = orientation
+
+        # Screen content as it should be displayed at next flush
+        self.canvas = Image.new("RGB", (width, height))
+
+        # Canvas pixels drawn by widgets. Other pixels do not match the display content (e.g. after a clear), so drawn
+        # rectangles are only merged together when all pixels of their union have been drawn
+        self.drawn = Image.new("1", (width, height))
+
+        # Rectangles (x0, y0, x1, y1) drawn since last flush
+        self.dirty = []
+
+        self.mutex = threading.Lock()
+
+    def draw(self, image: Image, x: int, y: int):
+        # Paste an image in the canvas. It will be sent to the display at next flush
+        image_width = min(image.size[0], self.width - x)
+        image_height = min(image.size[1], self.height - y)
+        if image_width <= 0 or image_height <= 0:
+            return
+
+        rect = (x, y, x + image_width - 1, y + image_height - 1)
+        with self.mutex:
+            self.canvas.paste(image, (x, y))
+            self.drawn.paste(1, (rect[0], rect[1], rect[2] + 1, rect[3] + 1))
+            if not any(contains(dirty, rect) for dirty in self.dirty):
+                self.dirty = [dirty for dirty in self.dirty if not contains(rect, dirty)]
+                self.dirty.append(rect)
+
+    def flush(self, cost_model: CostModel = None) -> List[Tuple[Image.Image, int, int]]:
+        # Return the regions drawn since last flush as (image, x, y), and mark them as sent
+        # With a cost model, drawn rectangles are merged when sending them together is cheaper
+        with self.mutex:
+            dirty = self.dirty
+            self.dirty = []
+            if not dirty:
+                return []
+
+            if cost_model is not None:
+                dirty = merge_rectangles(dirty, cost_model, self._is_drawn)
+
+            # Copy the regions while holding the lock: widgets can draw again as soon as it is released
+            return [(self.canvas.crop((x0, y0, x1 + 1, y1 + 1)), x0, y0) for (x0, y0, x1, y1) in dirty]
+
+    def _is_drawn(self, rect: Tuple[int, int, int, int]) -> bool:
+        (x0, y0, x1, y1) = rect
+        return self.drawn.crop((x0, y0, x1 + 1, y1 + 1)).getextrema()[0] != 0
@@ -0,0 +1,199 @@
+# turing-smart-screen-python - a Python system monitor and library for 3.5" USB-C displays like Turing Smart Screen or XuanFang
+# https://github.com/mathoudebine/turing-smart-screen-python/
+
+# Copyright (C) 2021-2023  Matthieu Houdebine (mathoudebine)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# This file contains a shadow framebuffer: a copy of the display content in the display pixel format
+# It is used to only send to the display the pixels that have changed since the last update
+
+import threading
+from typing import List, Tuple
+
+from library.lcd.rect_planner import CostModel, plan_rectangles
+
+# Changed pixels are grouped by tiles of TILE_SIZE x TILE_SIZE pixels before planning the rectangles to send
+TILE_SIZE = 8
+
+# NumPy is optional: it greatly speeds up comparisons but is not mandatory
+try:
+    import numpy as np
+except:
+    np = None
+
+
+class ShadowFramebuffer:
+    def __init__(self, width: int, height: int, bytes_per_pixel: int, orientation: int = 0):
+        # Framebuffer size and orientation must match the display coordinates used in bitmap commands
+        self.width = width
+        self.height = height
+        self.bytes_per_pixel = bytes_per_pixel
+        self.orientation = orientation
+
+        # Pixels sent to the display, and whether each pixel content is known (e.g. not after a display reset)
+        if np is not None:
+            self.pixels = np.zeros((height, width, bytes_per_pixel), dtype=np.uint8)
+            self.known = np.zeros((height, width), dtype=bool)
+            # Change mask of the last update
+            self.changed = None
+        else:
+            self.pixels = bytearray(width * height * bytes_per_pixel)
+            self.known = bytearray(width * height)
+
+        # Callers should hold this lock from the framebuffer update until the changed pixels are sent/queued
+        self.mutex = threading.Lock()
+
+    def invalidate(self):
+        # Display content is not known anymore: next updates will be fully sent
+        if np is not None:
+            self.known[:] = False
+        else:
+            self.known[:] = bytes(len(self.known))
+
+    def update(self, data, x0: int, y0: int, x1: int, y1: int,
+               cost_model: CostModel = None) -> List[Tuple[object, int, int, int, int]]:
+        # Store the new content of rectangle (x0, y0) - (x1, y1) and compare it to the previous content
+        # Return the rectangles to send to the display as (data, x0, y0, x1, y1), or an empty list if nothing changed
+        # Without cost model, the bounding box of the changed pixels is returned. With a cost model, changed pixels are
+        # grouped by tiles of TILE_SIZE pixels, and the rectangles are planned with plan_rectangles()
+        if np is not None:
+            bands = self._update_numpy(data, x0, y0, x1, y1)
+        else:
+            bands = self._update_python(data, x0, y0, x1, y1)
+
+        if not bands:
+            return []
+
+        if cost_model is None:
+            rects = [(min(b[2][0][0] for b in bands), bands[0][0], max(b[2][-1][1] for b in bands), bands[-1][1])]
+        else:
+            rects = plan_rectangles(bands, cost_model)
+
+        if np is not None:
+            # Planned rectangles are aligned on tiles: shrink them to the bounding box of their changed pixels
+            rects = [self._shrink_numpy(rect, x0, y0) for rect in rects]
+
+        if rects == [(x0, y0, x1, y1)]:
+            # Whole rectangle has changed: send data as is
+            return [(data, x0, y0, x1, y1)]
+        else:
+            return [(self.get_pixels(*rect),) + tuple(rect) for rect in rects]
+
+    def get_pixels(self, x0: int, y0: int, x1: int, y1: int):
+        # Return a copy of the stored content of rectangle (x0, y0) - (x1, y1), serialized row by row
+        # Content is copied because it may be queued, and sent after next updates
+        if np is not None:
+            return memoryview(self.pixels[y0:y1 + 1, x0:x1 + 1].tobytes())
+
+        stride = self.width * self.bytes_per_pixel
+        start = x0 * self.bytes_per_pixel
+        end = (x1 + 1) * self.bytes_per_pixel
+        return memoryview(b"".join(self.pixels[y * stride + start:y * stride + end] for y in range(y0, y1 + 1)))
+
+    def _update_numpy(self, data, x0: int, y0: int, x1: int, y1: int):
+        new = np.frombuffer(data, dtype=np.uint8).reshape((y1 - y0 + 1, x1 - x0 + 1, self.bytes_per_pixel))
+        old = self.pixels[y0:y1 + 1, x0:x1 + 1]
+
+        changed = (old != new).any(axis=2) | ~self.known[y0:y1 + 1, x0:x1 + 1]
+        self.changed = changed
+        old[...] = new
+        self.known[y0:y1 + 1, x0:x1 + 1] = True
+
+        if not changed.any():
+            return []
+
+        # Reduce the change mask to tiles of TILE_SIZE x TILE_SIZE pixels (aligned on the rectangle origin)
+        (height, width) = changed.shape
+        tiles_height = (height + TILE_SIZE - 1) // TILE_SIZE
+        tiles_width = (width + TILE_SIZE - 1) // TILE_SIZE
+        padded = np.zeros((tiles_height * TILE_SIZE, tiles_width * TILE_SIZE), dtype=bool)
+        padded[:height, :width] = changed
+        tiles = padded.reshape((tiles_height, TILE_SIZE, tiles_width, TILE_SIZE)).any(axis=(1, 3))
+
+        # Convert each row of tiles to a band with the spans of changed tiles, clipped to the rectangle
+        bands = []
+        for tile_row in np.flatnonzero(tiles.any(axis=1)):
+            edges = np.flatnonzero(np.diff(np.concatenate(([0], tiles[tile_row].view(np.int8), [0]))))
+            spans = [(x0 + int(start) * TILE_SIZE, x0 + min(int(end) * TILE_SIZE, width) - 1)
+                     for start, end in zip(edges[::2], edges[1::2])]
+            bands.append((y0 + int(tile_row) * TILE_SIZE, y0 + min((int(tile_row) + 1) * TILE_SIZE, height) - 1, spans))
+        return bands
+
+    def _shrink_numpy(self, rect, x0: int, y0: int):
+        # Bounding box of the changed pixels of the last update inside rect (changed mask origin is x0, y0)
+        mask = self.changed[rect[1] - y0:rect[3] - y0 + 1, rect[0] - x0:rect[2] - x0 + 1]
+        rows = np.flatnonzero(mask.any(axis=1))
+        columns = np.flatnonzero(mask.any(axis=0))
+        return (rect[0] + int(columns[0]), rect[1] + int(rows[0]),
+                rect[0] + int(columns[-1]), rect[1] + int(rows[-1]))
+
+    def _update_python(self, data, x0: int, y0: int, x1: int, y1: int):
+        bpp = self.bytes_per_pixel
+        data = memoryview(data).cast("B")
+        region_width = x1 - x0 + 1
+        row_size = region_width * bpp
+        stride = self.width * bpp
+
+        # Bands of TILE_SIZE rows, each with a single span covering the changed pixels of its rows
+        bands = []
+        for row in range(y1 - y0 + 1):
+            new = data[row * row_size:(row + 1) * row_size]
+            start = (y0 + row) * stride + x0 * bpp
+            known_start = (y0 + row) * self.width + x0
+            old = self.pixels[start:start + row_size]
+
+            if self.known.count(0, known_start, known_start + region_width):
+                # Some pixels of this row are unknown: whole row has to be sent
+                (first, last) = (0, region_width - 1)
+                self.known[known_start:known_start + region_width] = b"\x01" * region_width
+            elif old == new:
+                continue
+            else:
+                (first, last) = (_first_difference(old, new) // bpp, (row_size - 1 - _last_difference(old, new)) // bpp)
+
+            self.pixels[start:start + row_size] = new
+
+            if bands and (bands[-1][0] - y0) // TILE_SIZE == row // TILE_SIZE:
+                (band_y0, _, [(span_x0, span_x1)]) = bands[-1]
+                bands[-1] = (band_y0, y0 + row, [(min(span_x0, x0 + first), max(span_x1, x0 + last))])
+            else:
+                bands.append((y0 + row, y0 + row, [(x0 + first, x0 + last)]))
+
+        return bands
+
+
+def _first_difference(a, b) -> int:
+    # Index of the first different byte between 2 buffers of same size that are known to differ
+    # Binary search on slices comparisons, to stay in C code as much as possible
+    (low, high) = (0, len(a))
+    while high - low > 1:
+        middle = (low + high) // 2
+        if a[low:middle] == b[low:middle]:
+            low = middle
+        else:
+            high = middle
+    return low
+
+
+def _last_difference(a, b) -> int:
+    # Number of identical bytes at the end of 2 buffers of same size that are known to differ
+    (low, high) = (0, len(a))
+    while high - low > 1:
+        middle = (low + high) // 2
+        if a[len(a) - middle:len(a) - low] == b[len(b) - middle:len(b) - low]:
+            low = middle
+        else:
+            high = middle
+    return low
@@ -0,0 +1,178 @@
+# turing-smart-screen-python - a Python system monitor and library for 3.5" USB-C displays like Turing Smart Screen or XuanFang
+# https://github.com/mathoudebine/turing-smart-screen-python/
+
+# Copyright (C) 2021-2023  Matthieu Houdebine (mathoudebine)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# This file contains a glyph atlas for numeric texts rendered with monospace fonts: each glyph is rendered once for a
+# given color and background, converted to the display pixel format, and texts are composed by concatenating the tiles
+# of their glyphs. This avoids rendering the whole text with ImageDraw at each refresh.
+# A font is only used with the atlas if composed texts are identical to the ones rendered by ImageDraw: all glyphs must
+# have the same integer advance, their ink must stay inside their cell, and glyph pairs must not be kerned
+
+import functools
+import threading
+from typing import Optional, Tuple
+
+from PIL import Image, ImageDraw, ImageFont
+
+from library.lcd.cache import get_background_image
+from library.lcd.codec import PixelCodec
+
+# NumPy is optional: without it, texts are always rendered with ImageDraw
+try:
+    import numpy as np
+except:
+    np = None
+
+# Characters of the numeric texts of the themes: values, separators and units
+NUMERIC_CHARSET = "0123456789 .,:/%+-°CFGHKMTWBbksz"
+
+# Maximum number of glyph tiles kept per atlas
+MAX_TILES = 4096
+
+# Drawing context only used to measure texts
+_MEASURE_DRAW = ImageDraw.Draw(Image.new('L', (1, 1)))
+
+
+class GlyphAtlas:
+    def __init__(self, font: ImageFont.FreeTypeFont):
+        self.font = font
+
+        # Glyphs that can be composed: char -> number of columns of ink beyond the glyph cell, on the right side
+        # A glyph with such overhang can only be the last one of a text (e.g. '%')
+        # Empty if the font cannot be used with the atlas
+        self.glyphs = {}
+        self.overhangs = {}
+
+        # Advance of all glyphs, and vertical range of the glyph cells relative to the text origin
+        self.advance = 0
+        self.cell_top = 0
+        self.cell_bottom = 0
+
+        # Glyph tiles converted to the display pixel format:
+        # (pixel format, font color, background, char, cell x, cell y) -> array of height x width x bytes per pixel
+        self.tiles = {}
+        self.mutex = threading.Lock()
+
+        if np is not None:
+            self._build()
+
+    def _build(self):
+        advance = self.font.getlength("0")
+        if advance != int(advance):
+            return
+        self.advance = int(advance)
+
+        boxes = {}
+        for c in NUMERIC_CHARSET:
+            box = self.font.getbbox(c)
+            if self.font.getlength(c) == advance and box[0] >= 0:
+                boxes[c] = box
+        if not boxes:
+            return
+
+        self.cell_top = min(box[1] for box in boxes.values())
+        self.cell_bottom = max(box[3] for box in boxes.values())
+        self.overhangs = {c: max(0, box[2] - self.advance) for c, box in boxes.items()}
+
+        # Check that glyph masks composed cell by cell are the same as the ones rendered by ImageDraw
+        masks = {c: self._render_tile(c, Image.new('L', self._get_tile_size(c), 0), 255) for c in self.overhangs}
+        samples = list(self.overhangs)
+        samples += [a + b for a in self.overhangs for b in self.overhangs if not self.overhangs[a]]
+        for text in samples:
+            left, top, right, bottom = _MEASURE_DRAW.textbbox((0, 0), text, font=self.font)
+            if right <= left or bottom <= top:
+                # Nothing is displayed for empty texts (e.g. a space)
+                continue
+            rendered = Image.new('L', (right - left, bottom - top), 0)
+            ImageDraw.Draw(rendered).text((-left, -top), text, font=self.font, fill=255)
+
+            composed = self._compose([np.asarray(masks[c])[..., np.newaxis] for c in text],
+                                     left, top, right - left, bottom - top)
+            if composed is None or composed.tobytes() != rendered.tobytes():
+                return
+
+        self.glyphs = self.overhangs
+
+    def can_render(self, text: str) -> bool:
+        # Only the last glyph of a text can have ink outside its cell
+        return bool(self.glyphs) and all(self.glyphs.get(c) == 0 for c in text[:-1]) and text[-1] in self.glyphs
+
+    def render(self, text: str, left: int, top: int, width: int, height: int, font_color: Tuple[int, int, int],
+               background, codec: PixelCodec, x: int, y: int, rotate_180: bool = False) -> Optional[memoryview]:
+        # Return the bitmap of a text in the display pixel format, as DisplayText would render it:
+        # text bounding box is (left, top) - (left + width, top + height) and the bitmap is displayed at (x, y)
+        # Background is a color, or the path of a background image
+        # Return None if the text cannot be composed with glyph tiles
+        if isinstance(background, str):
+            # Tiles depend on the part of the background image behind them: text origin on screen is part of the key
+            (origin_x, origin_y) = (x - left, y - top)
+        else:
+            (origin_x, origin_y) = (0, 0)
+
+        tiles = []
+        for i, c in enumerate(text):
+            key = (codec.pixel_format, font_color, background, c, origin_x + i * self.advance, origin_y)
+            with self.mutex:
+                tile = self.tiles.get(key)
+            if tile is None:
+                tile = self._encode_tile(c, font_color, background, codec, key[4], origin_y)
+                with self.mutex:
+                    if len(self.tiles) >= MAX_TILES:
+                        self.tiles.clear()
+                    self.tiles[key] = tile
+            tiles.append(tile)
+
+        composed = self._compose(tiles, left, top, width, height)
+        if composed is None:
+            return None
+        if rotate_180:
+            composed = composed[::-1, ::-1]
+        return memoryview(np.ascontiguousarray(composed)).cast("B")
+
+    def _get_tile_size(self, c: str) -> Tuple[int, int]:
+        return self.advance + self.overhangs[c], self.cell_bottom - self.cell_top
+
+    def _render_tile(self, c: str, tile: Image, font_color) -> Image:
+        # Draw a glyph in its cell: the cell origin is the text origin for the first glyph of a text
+        ImageDraw.Draw(tile).text((0, -self.cell_top), c, font=self.font, fill=font_color)
+        return tile
+
+    def _encode_tile(self, c: str, font_color, background, codec: PixelCodec, cell_x: int, cell_y: int):
+        (tile_width, tile_height) = self._get_tile_size(c)
+        if isinstance(background, str):
+            tile = get_background_image(background).crop((cell_x, cell_y + self.cell_top,
+                                                           cell_x + tile_width, cell_y + self.cell_bottom))
+        else:
+            tile = Image.new('RGB', (tile_width, tile_height), background)
+        self._render_tile(c, tile, font_color)
+        return np.frombuffer(codec.encode(tile), dtype=np.uint8).reshape((tile_height, tile_width,
+                                                                         codec.bytes_per_pixel))
+
+    def _compose(self, tiles, left: int, top: int, width: int, height: int):
+        # Concatenate the glyph cells, and keep the text bounding box
+        if left < 0 or top < self.cell_top or top + height > self.cell_bottom or width <= 0 or height <= 0:
+            return None
+        line = np.concatenate([tile[:, :self.advance] for tile in tiles[:-1]] + [tiles[-1]], axis=1)
+        if left + width > line.shape[1]:
+            return None
+        return line[top - self.cell_top:top - self.cell_top + height, left:left + width]
+
+
+@functools.lru_cache(maxsize=32)
+def get_glyph_atlas(font: ImageFont.FreeTypeFont) -> GlyphAtlas:
+    # One atlas per loaded font (fonts are shared, see cache.get_font)
+    return GlyphAtlas(font)
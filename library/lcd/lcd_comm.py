@@ -20,16 +20,35 @@ import os
 import queue
 import sys
 import threading
+import time
 from abc import ABC, abstractmethod
 from enum import IntEnum
 from typing import Tuple
 
 import serial
-from PIL import Image, ImageDraw, ImageFont
-
+from PIL import Image, ImageDraw
+
+import library.lcd.blend as blend
+import library.lcd.serialize as serialize
+from library.lcd.cache import BitmapCache, ImagePool, RenderedTextCache, get_background_image, get_font
+from library.lcd.codec import PixelFormat, get_codec
+from library.lcd.compositor import FrameCompositor
+from library.lcd.framebuffer import ShadowFramebuffer
+from library.lcd.glyph_atlas import get_glyph_atlas
+from library.lcd.progress_bar import ProgressBarSprites
+from library.lcd.rect_planner import CostModel, WriteTimings
+from library.lcd.serialize import iter_chunks
+from library.lcd.update_queue import PRIORITY_LOW, PRIORITY_NORMAL, PRIORITY_URGENT, UpdateQueue
 from library.log import logger
 
 
+# Drawing context only used to measure texts before allocating their bitmap
+_TEXT_MEASURE_DRAW = ImageDraw.Draw(Image.new('RGB', (1, 1)))
+
+# Size in bytes above which merged serial writes are sent without waiting for the end of the batch
+MAX_WRITE_BATCH_SIZE = 65536
+
+
 class Orientation(IntEnum):
     PORTRAIT = 0
     LANDSCAPE = 2
@@ -38,6 +57,21 @@ class Orientation(IntEnum):
 
 
 class LcdComm(ABC):
+    # Pixel format used by the display to receive bitmaps (see codec.py)
+    PIXEL_FORMAT = PixelFormat.RGB565_LE
+
+    # Set to True if the reverse orientations are not managed by the display and need to be done by software
+    SOFTWARE_REVERSE_ORIENTATION = False
+
+    # Size in bytes of the command sent before bitmap data, and initial estimation of the per-command latency of the
+    # link as an equivalent number of bytes. Both are used to plan partial updates (see rect_planner.py)
+    BITMAP_COMMAND_SIZE = 6
+    BITMAP_COMMAND_OVERHEAD = 64
+
+    # Bitmaps larger than this size in bytes are sent as bands of rows with a low priority, so that more urgent requests
+    # can be sent between bands. 0 to always send bitmaps in one request
+    MAX_BITMAP_REQUEST_SIZE = 16384
+
     def __init__(self, com_port: str = "AUTO", display_width: int = 320, display_height: int = 480,
                  update_queue: queue.Queue = None):
         self.lcd_serial = None
@@ -60,6 +94,64 @@ class LcdComm(ABC):
         # mixed with other requests in-between
         self.update_queue_mutex = threading.Lock()
 
+        # Size in bytes of the image data chunks written to the serial link. If 0, use 4 lines of the display width
+        self.chunk_size = 0
+
+        # Priority and deadline of the requests sent by each thread (see SetRequestDeadline)
+        self.request_context = threading.local()
+
+        # Serial writes merged between BeginWriteBatch() and EndWriteBatch(), by the thread that started the batch
+        self.write_batch = None
+        self.write_batch_thread = None
+        self.write_batch_commands = 0
+        self.write_batch_command_bytes = 0
+
+        # Cache of bitmaps already converted to the display pixel format
+        self.bitmap_cache = BitmapCache()
+
+        # Layout engine used to render text: None for Pillow default (Raqm if available, for complex text shaping)
+        # or ImageFont.Layout.BASIC which is faster but does not support complex scripts
+        self.font_layout_engine = None
+
+        # Blend texts directly in RGB565 over pre-converted backgrounds, instead of rendering them in RGB then
+        # converting them. Faster, but antialiased pixels can differ by one RGB565 level. Only for RGB565 displays,
+        # needs NumPy
+        self.rgb565_text_blending = False
+
+        # Texts already rendered and converted to the display pixel format
+        self.text_cache = RenderedTextCache()
+
+        # Scratch images reused to render texts with solid background
+        self.image_pool = ImagePool()
+
+        # Empty/full sprites of the progress bars: bar parameters -> (background image, sprites)
+        self.progress_bar_sprites = {}
+
+        # Sprites and number of filled columns last displayed for each progress bar: bar position -> (sprites, width)
+        # Only the columns between the previous and the new fill edges are sent when a bar value changes
+        self.progress_bar_filled_widths = {}
+
+        # Optional copy of the display content in the display pixel format, used to only send the pixels that changed
+        # Use EnableShadowFramebuffer() to enable it
+        self.shadow_framebuffer = None
+
+        # Optional canvas of the whole screen: images are drawn in it and only sent to the display on Flush()
+        # Use EnableFrameComposition() to enable it
+        self.compositor = None
+
+        # Cost model used to plan partial updates, calibrated with the serial link timings measured on writes
+        self.cost_model = CostModel(self.BITMAP_COMMAND_SIZE, get_codec(self.PIXEL_FORMAT).bytes_per_pixel,
+                                    self.BITMAP_COMMAND_OVERHEAD)
+        self.write_timings = WriteTimings()
+        self.commands_written = 0
+
+        # Use the fastest pixel conversion backend available on this host (benchmark is only run once)
+        if not serialize.backend_timings:
+            timings = serialize.select_fastest_backend()
+            logger.info("Pixel conversion backend: %s (%s)" % (
+                serialize.rgb565_backend,
+                ", ".join("%s %.2fms" % (name, t * 1000) for name, t in timings.items())))
+
     def get_width(self) -> int:
         if self.orientation == Orientation.PORTRAIT or self.orientation == Orientation.REVERSE_PORTRAIT:
             return self.display_width
@@ -72,6 +164,50 @@ class LcdComm(ABC):
         else:
             return self.display_width
 
+    def is_software_reversed(self) -> bool:
+        return self.SOFTWARE_REVERSE_ORIENTATION and (
+                self.orientation == Orientation.REVERSE_PORTRAIT or self.orientation == Orientation.REVERSE_LANDSCAPE)
+
+    def EnableShadowFramebuffer(self, enabled: bool = True):
+        if enabled:
+            self.shadow_framebuffer = ShadowFramebuffer(self.get_width(), self.get_height(),
+                                                        get_codec(self.PIXEL_FORMAT).bytes_per_pixel,
+                                                        self.orientation)
+        else:
+            self.shadow_framebuffer = None
+
+    def InvalidateDisplayContent(self):
+        # To be called when the display content is modified outside of bitmap commands (reset, clear, orientation...)
+        if self.shadow_framebuffer is not None:
+            self.shadow_framebuffer.invalidate()
+
+        # Progress bars will be fully redrawn
+        self.progress_bar_filled_widths.clear()
+
+    def EnableFrameComposition(self, enabled: bool = True):
+        # In frame composition mode, display functions only draw into an in-memory canvas of the screen
+        # Flush() must then be called periodically to send the regions drawn since the previous call
+        if enabled:
+            self.compositor = FrameCompositor(self.get_width(), self.get_height(), self.orientation)
+        else:
+            self.Flush()
+            self.compositor = None
+
+    def Flush(self):
+        # Send to the display the regions of the canvas drawn since last flush (frame composition mode only)
+        if self.compositor is None:
+            return
+
+        for (image, x, y) in self.compositor.flush(self.cost_model):
+            self.DisplayEncodedImage(self.EncodeImage(image), x, y, image.size[0], image.size[1])
+
+    def get_chunk_size(self) -> int:
+        if self.chunk_size:
+            return self.chunk_size
+        else:
+            # 4 lines of 2-byte pixels
+            return self.get_width() * 8
+
     def openSerial(self):
         if self.com_port == 'AUTO':
             lcd_com_port = self.auto_detect_com_port()
@@ -95,26 +231,109 @@ class LcdComm(ABC):
             pass
 
     def WriteData(self, byteBuffer: bytearray):
+        if self.is_write_batch_thread():
+            self.write_batch += byteBuffer
+            self.write_batch_commands += 1
+            self.write_batch_command_bytes += len(byteBuffer)
+            return
+
+        start = time.perf_counter()
         try:
             self.lcd_serial.write(bytes(byteBuffer))
         except serial.serialutil.SerialTimeoutException:
             # We timed-out trying to write to our device, slow things down.
             logger.warning("(Write data) Too fast! Slow down!")
-
-    def SendLine(self, line: bytes):
-        if self.update_queue:
-            # Queue the request. Mutex is locked by caller to queue multiple lines
-            self.update_queue.put((self.WriteLine, [line]))
+        self.update_write_timings(1, 0, time.perf_counter() - start)
+
+    def update_write_timings(self, commands: int, data_bytes: int, write_time: float):
+        self.write_timings.add(commands, data_bytes, write_time)
+        self.commands_written += commands
+
+        # Periodically update the partial updates cost model with the measured timings
+        if self.commands_written % 64 < commands:
+            timings = self.write_timings.fit()
+            if timings is not None:
+                self.cost_model.calibrate(*timings)
+
+    def BeginWriteBatch(self):
+        # Until EndWriteBatch(), commands and data written by the calling thread are merged into larger serial writes
+        # Writes from other threads (e.g. requests bypassing the queue) are not delayed
+        self.write_batch = bytearray()
+        self.write_batch_thread = threading.get_ident()
+
+    def EndWriteBatch(self):
+        self.FlushWriteBatch()
+        self.write_batch = None
+        self.write_batch_thread = None
+        self.write_batch_commands = 0
+        self.write_batch_command_bytes = 0
+
+    def is_write_batch_thread(self) -> bool:
+        return self.write_batch is not None and self.write_batch_thread == threading.get_ident()
+
+    def FlushWriteBatch(self):
+        if not self.write_batch:
+            return
+
+        start = time.perf_counter()
+        try:
+            self.lcd_serial.write(self.write_batch)
+        except serial.serialutil.SerialTimeoutException:
+            # We timed-out trying to write to our device, slow things down.
+            logger.warning("(Write batch) Too fast! Slow down!")
+
+        # Time of the whole batch is a sample of the link timings: the per-command and per-byte costs are fitted over
+        # batches with different proportions of commands and data
+        data_bytes = len(self.write_batch) - self.write_batch_command_bytes
+        self.update_write_timings(self.write_batch_commands, data_bytes, time.perf_counter() - start)
+
+        self.write_batch = bytearray()
+        self.write_batch_commands = 0
+        self.write_batch_command_bytes = 0
+
+    def SendRequest(self, byteBuffer: bytearray, data=None, region: Tuple[int, int, int, int] = None,
+                    bypass_queue: bool = False):
+        # Send a command, optionally followed by bitmap data for the display rectangle region = (x0, y0, x1, y1)
+        # Command and data are queued as a single request, so they cannot be split by requests from other threads
+        if not self.update_queue or bypass_queue:
+            self.WriteRequest(byteBuffer, data)
+        elif isinstance(self.update_queue, UpdateQueue):
+            # Pending requests for a region covered by this one are dropped: only the latest pixels need to be sent
+            deadline = getattr(self.request_context, "deadline", None)
+            priority = getattr(self.request_context, "priority", None)
+            if priority is None:
+                priority = PRIORITY_URGENT if deadline is not None else PRIORITY_NORMAL
+            self.update_queue.put((self.WriteRequest, [byteBuffer, data]), region=region, priority=priority,
+                                  deadline=deadline)
         else:
-            # If no queue for async requests: do request now
-            self.WriteLine(line)
-
-    def WriteLine(self, line: bytes):
+            self.update_queue.put((self.WriteRequest, [byteBuffer, data]))
+
+    def SetRequestDeadline(self, deadline: float = None):
+        # Requests sent by the calling thread until SetRequestDeadline(None) should be displayed before deadline
+        # (time.monotonic() time): they are sent before requests without deadline
+        self.request_context.deadline = deadline
+
+    def WriteRequest(self, byteBuffer: bytearray, data=None):
+        self.WriteData(byteBuffer)
+        if data is not None:
+            # Send image data by chunks of get_chunk_size() bytes
+            for chunk in iter_chunks(data, self.get_chunk_size()):
+                self.WriteLine(chunk)
+
+    def WriteLine(self, line):
+        if self.is_write_batch_thread():
+            self.write_batch += line
+            if len(self.write_batch) >= MAX_WRITE_BATCH_SIZE:
+                self.FlushWriteBatch()
+            return
+
+        start = time.perf_counter()
         try:
             self.lcd_serial.write(line)
         except serial.serialutil.SerialTimeoutException:
             # We timed-out trying to write to our device, slow things down.
             logger.warning("(Write line) Too fast! Slow down!")
+        self.update_write_timings(0, len(line), time.perf_counter() - start)
 
     @staticmethod
     @abstractmethod
@@ -154,6 +373,11 @@ class LcdComm(ABC):
         pass
 
     @abstractmethod
+    def SendBitmap(self, data, x0: int, y0: int, x1: int, y1: int):
+        # Send pixels already converted to the display pixel format, to the display rectangle (x0, y0) - (x1, y1)
+        # Coordinates are the display ones: reverse orientations managed by software are already applied
+        pass
+
     def DisplayPILImage(
             self,
             image: Image,
@@ -161,11 +385,103 @@ class LcdComm(ABC):
             image_width: int = 0,
             image_height: int = 0
     ):
-        pass
+        image = self.CropImage(image, x, y, image_width, image_height)
+
+        if self.compositor is not None:
+            if self.compositor.orientation != self.orientation:
+                # Screen size has changed: start again with an empty canvas
+                self.EnableFrameComposition()
+            self.compositor.draw(image, x, y)
+            return
+
+        self.DisplayEncodedImage(self.EncodeImage(image), x, y, image.size[0], image.size[1])
+
+    def EncodeImage(self, image: Image) -> memoryview:
+        # Convert a PIL image to the pixel format sent to the display
+        return get_codec(self.PIXEL_FORMAT).encode(image, rotate_180=self.is_software_reversed())
+
+    def DisplayEncodedImage(self, data, x: int, y: int, image_width: int, image_height: int):
+        # Display pixels already converted by EncodeImage
+        if self.is_software_reversed():
+            # Image has already been rotated by 180° during conversion: only coordinates need to be reversed
+            (x0, y0) = (self.get_width() - x - image_width, self.get_height() - y - image_height)
+            (x1, y1) = (self.get_width() - x - 1, self.get_height() - y - 1)
+        else:
+            (x0, y0) = (x, y)
+            (x1, y1) = (x + image_width - 1, y + image_height - 1)
+
+        if self.shadow_framebuffer is None:
+            self.send_bitmap_bands(data, x0, y0, x1, y1)
+            return
+
+        if self.shadow_framebuffer.orientation != self.orientation:
+            # Display coordinates have changed: start with an unknown display content
+            self.EnableShadowFramebuffer()
+
+        framebuffer = self.shadow_framebuffer
+        with framebuffer.mutex:
+            # Only send the pixels that changed, if any, grouped in the cheapest set of rectangles
+            for changes in framebuffer.update(data, x0, y0, x1, y1, self.cost_model):
+                self.send_bitmap_bands(*changes)
+
+    def send_bitmap_bands(self, data, x0: int, y0: int, x1: int, y1: int):
+        # Send large bitmaps as bands of rows with a low priority: each band is a complete bitmap command, and more
+        # urgent requests can be sent between bands. Bitmaps sent with a deadline are never split
+        if (not self.MAX_BITMAP_REQUEST_SIZE or len(data) <= self.MAX_BITMAP_REQUEST_SIZE
+                or not isinstance(self.update_queue, UpdateQueue)
+                or getattr(self.request_context, "deadline", None) is not None):
+            self.SendBitmap(data, x0, y0, x1, y1)
+            return
+
+        row_size = len(data) // (y1 - y0 + 1)
+        band_rows = max(1, self.MAX_BITMAP_REQUEST_SIZE // row_size)
+        self.request_context.priority = PRIORITY_LOW
+        try:
+            for band_y0 in range(y0, y1 + 1, band_rows):
+                band_y1 = min(band_y0 + band_rows - 1, y1)
+                self.SendBitmap(data[(band_y0 - y0) * row_size:(band_y1 - y0 + 1) * row_size], x0, band_y0, x1, band_y1)
+        finally:
+            self.request_context.priority = None
+
+    def CropImage(
+            self,
+            image: Image,
+            x: int = 0, y: int = 0,
+            image_width: int = 0,
+            image_height: int = 0
+    ) -> Image:
+        # If the image height/width isn't provided, use the native image size
+        if not image_height:
+            image_height = image.size[1]
+        if not image_width:
+            image_width = image.size[0]
+
+        # If our image is bigger than our display, resize it to fit our screen
+        if image.size[1] > self.get_height():
+            image_height = self.get_height()
+        if image.size[0] > self.get_width():
+            image_width = self.get_width()
+
+        assert x <= self.get_width(), 'Image X coordinate must be <= display width'
+        assert y <= self.get_height(), 'Image Y coordinate must be <= display height'
+        assert image_height > 0, 'Image height must be > 0'
+        assert image_width > 0, 'Image width must be > 0'
+
+        # Keep only the part of the image that will be displayed
+        if image.size[0] != image_width or image.size[1] != image_height:
+            image = image.crop((0, 0, image_width, image_height))
+
+        return image
 
     def DisplayBitmap(self, bitmap_path: str, x: int = 0, y: int = 0, width: int = 0, height: int = 0):
-        image = Image.open(bitmap_path)
-        self.DisplayPILImage(image, x, y, width, height)
+        if self.compositor is not None:
+            # Bitmap is drawn into the canvas, and will be converted with the other regions drawn before next flush
+            self.DisplayPILImage(Image.open(bitmap_path), x, y, width, height)
+            return
+
+        # Bitmaps are converted once to the display pixel format, then served from the cache
+        data, width, height = self.bitmap_cache.get(self, bitmap_path, x, y, width, height)
+        self.DisplayEncodedImage(data, x, y, width, height)
 
     def DisplayText(
             self,
@@ -195,33 +511,78 @@ class LcdComm(ABC):
         assert len(text) > 0, 'Text must not be empty'
         assert font_size > 0, "Font size must be > 0"
 
-        if background_image is None:
-            # A text bitmap is created with max width/height by default : text with solid background
-            text_image = Image.new(
-                'RGB',
-                (self.get_width(), self.get_height()),
-                background_color
-            )
-        else:
-            # The text bitmap is created from provided background image : text with transparent background
-            text_image = Image.open(background_image)
-
-        # Get text bounding box
-        font = ImageFont.truetype("./res/fonts/" + font, font_size)
-        d = ImageDraw.Draw(text_image)
-        left, top, text_width, text_height = d.textbbox((0, 0), text, font=font)
+        if self.compositor is None:
+            # Texts already displayed with the same content and style are not rendered/converted again
+            text_key = (text, x, y, font, font_size, self.font_layout_engine, font_color,
+                        background_color if background_image is None else (
+                            background_image, os.stat(background_image).st_mtime_ns),
+                        align, self.orientation, self.PIXEL_FORMAT)
+            entry = self.text_cache.get(text_key)
+            if entry is not None:
+                self.DisplayEncodedImage(entry[0], x, y, entry[1], entry[2])
+                return
+
+        font = get_font("./res/fonts/" + font, font_size, self.font_layout_engine)
+
+        # Get text bounding box, and the size of the text bitmap (crop if text overflows display)
+        left, top, text_width, text_height = _TEXT_MEASURE_DRAW.textbbox((0, 0), text, font=font)
+        bitmap_size = (min(x + text_width - left, self.get_width()) - x,
+                       min(y + text_height - top, self.get_height()) - y)
+
+        data = None
+        if self.compositor is None and bitmap_size[0] > 0 and bitmap_size[1] > 0:
+            # Numeric texts with monospace fonts are composed from pre-rendered glyphs, if the result is identical
+            atlas = get_glyph_atlas(font)
+            if atlas.can_render(text):
+                data = atlas.render(text, left, top, bitmap_size[0], bitmap_size[1], font_color,
+                                    background_color if background_image is None else background_image,
+                                    get_codec(self.PIXEL_FORMAT), x, y, self.is_software_reversed())
+
+        if data is None and self.rgb565_text_blending and self.compositor is None and bitmap_size[0] > 0 and \
+                bitmap_size[1] > 0 and blend.is_supported(self.PIXEL_FORMAT):
+            # Only the text coverage is rendered, then blended over the background in the display pixel format
+            mask = Image.new('L', bitmap_size, 0)
+            ImageDraw.Draw(mask).text((-left, -top), text, font=font, fill=255, align=align)
+            data = blend.blend_text_RGB565(mask, font_color, self.PIXEL_FORMAT, x, y, background_color,
+                                           background_image, self.is_software_reversed())
+
+        if data is None:
+            if background_image is None:
+                # A text bitmap of the text size is created : text with solid background
+                text_image = self.image_pool.acquire('RGB', bitmap_size, background_color)
+            else:
+                # The text bitmap is created from the part of the provided background image behind the text : text
+                # with transparent background
+                text_image = get_background_image(background_image).crop(box=(x, y, x + bitmap_size[0],
+                                                                              y + bitmap_size[1]))
+
+            # Draw text with specified color & font, remove left/top margins
+            ImageDraw.Draw(text_image).text((-left, -top), text, font=font, fill=font_color, align=align)
+
+            if self.compositor is not None:
+                self.DisplayPILImage(text_image, x, y)
+            else:
+                text_image = self.CropImage(text_image, x, y)
+                data = self.EncodeImage(text_image)
+
+            if background_image is None:
+                # Text bitmap has been converted or copied: it can be reused
+                self.image_pool.release(text_image)
+
+            if data is None:
+                return
+
+        self.text_cache.put(text_key, (data, bitmap_size[0], bitmap_size[1]))
+        self.DisplayEncodedImage(data, x, y, bitmap_size[0], bitmap_size[1])
 
-        # Draw text with specified color & font, remove left/top margins
-        d.text((x - left, y - top), text, font=font, fill=font_color, align=align)
-
-        # Crop text bitmap to keep only the text (also crop if text overflows display)
-        text_image = text_image.crop(box=(
-            x, y,
-            min(x + text_width - left, self.get_width()),
-            min(y + text_height - top, self.get_height())
-        ))
+    @staticmethod
+    def get_progress_bar_filled_width(width: int, min_value: int, max_value: int, value: int) -> int:
+        # Number of pixel columns filled by a progress bar of the provided width
+        # Value must already be clamped in [min_value, max_value]
+        bar_filled_width = (value - min_value) / (max_value - min_value) * width
 
-        self.DisplayPILImage(text_image, x, y)
+        # Same as drawing a rectangle up to x = bar_filled_width - 1: PIL truncates float coordinates
+        return int(bar_filled_width - 1) + 1
 
     def DisplayProgressBar(self, x: int, y: int, width: int, height: int, min_value: int = 0, max_value: int = 100,
                            value: int = 50,
@@ -251,23 +612,57 @@ class LcdComm(ABC):
 
         assert min_value <= value <= max_value, 'Progress bar value shall be between min and max'
 
-        if background_image is None:
-            # A bitmap is created with solid background
-            bar_image = Image.new('RGB', (width, height), background_color)
-        else:
-            # A bitmap is created from provided background image
-            bar_image = Image.open(background_image)
-
-            # Crop bitmap to keep only the progress bar background
-            bar_image = bar_image.crop(box=(x, y, x + width, y + height))
+        # Empty and full bars are only drawn once: bar is then composed from the columns of both sprites
+        sprites = self.get_progress_bar_sprites(x, y, width, height, bar_color, bar_outline, background_color,
+                                                background_image)
+        bar_filled_width = self.get_progress_bar_filled_width(width, min_value, max_value, value)
 
-        # Draw progress bar
-        bar_filled_width = (value - min_value) / (max_value - min_value) * width
-        draw = ImageDraw.Draw(bar_image)
-        draw.rectangle([0, 0, bar_filled_width - 1, height - 1], fill=bar_color, outline=bar_color)
+        if self.compositor is not None:
+            self.DisplayPILImage(sprites.get_image(bar_filled_width), x, y)
+            return
 
-        if bar_outline:
-            # Draw outline
-            draw.rectangle([0, 0, width - 1, height - 1], fill=None, outline=bar_color)
+        # Bar is identified by its position: its colors may change with its value (e.g. thresholds)
+        bar = (x, y, width, height, self.orientation)
+        (previous_sprites, previous_filled_width) = self.progress_bar_filled_widths.get(bar, (None, None))
+        self.progress_bar_filled_widths[bar] = (sprites, bar_filled_width)
 
-        self.DisplayPILImage(bar_image, x, y)
+        if previous_sprites is not sprites or previous_filled_width == bar_filled_width:
+            # Bar is unknown, has changed style, or is redrawn with the same value: send it entirely
+            self.DisplayEncodedImage(sprites.get_data(bar_filled_width), x, y, width, height)
+        else:
+            # Only send the vertical strip between the previous and the new fill edges (it includes the outline
+            # columns if they are affected): filled columns from the full sprite, emptied ones from the empty sprite
+            start = min(previous_filled_width, bar_filled_width)
+            end = max(previous_filled_width, bar_filled_width)
+            self.DisplayEncodedImage(sprites.get_strip_data(start, end, bar_filled_width > previous_filled_width),
+                                     x + start, y, end - start, height)
+
+    def get_progress_bar_sprites(self, x: int, y: int, width: int, height: int, bar_color: Tuple[int, int, int],
+                                 bar_outline: bool, background_color: Tuple[int, int, int],
+                                 background_image: str = None) -> ProgressBarSprites:
+        if background_image is None:
+            # Sprites are created with solid background
+            background = None
+        else:
+            # Sprites are created from provided background image
+            background = get_background_image(background_image)
+
+        key = (x, y, width, height, bar_color, bar_outline,
+               background_color if background is None else background_image, self.orientation)
+        entry = self.progress_bar_sprites.get(key)
+
+        # Sprites are created again if the background image file has changed
+        if entry is None or entry[0] is not background:
+            if background is None:
+                bar_background = Image.new('RGB', (width, height), background_color)
+            else:
+                # Keep only the progress bar background
+                bar_background = background.crop(box=(x, y, x + width, y + height))
+
+            if len(self.progress_bar_sprites) >= 256:
+                self.progress_bar_sprites.clear()
+            entry = (background, ProgressBarSprites(bar_background, bar_color, bar_outline,
+                                                    get_codec(self.PIXEL_FORMAT), self.is_software_reversed()))
+            self.progress_bar_sprites[key] = entry
+
+        return entry[1]
@@ -16,7 +16,6 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-import struct
 import time
 
 from serial.tools.list_ports import comports
@@ -37,6 +36,13 @@ class Command(IntEnum):
 
 
 class LcdCommRevA(LcdComm):
+    # HW revision A receives RGB565 little-endian pixels and manages all orientations
+    PIXEL_FORMAT = PixelFormat.RGB565_LE
+    SOFTWARE_REVERSE_ORIENTATION = False
+
+    # 6-byte DISPLAY_BITMAP command
+    BITMAP_COMMAND_SIZE = 6
+
     def __init__(self, com_port: str = "AUTO", display_width: int = 320, display_height: int = 480,
                  update_queue: queue.Queue = None):
         LcdComm.__init__(self, com_port, display_width, display_height, update_queue)
@@ -56,7 +62,8 @@ class LcdCommRevA(LcdComm):
 
         return auto_com_port
 
-    def SendCommand(self, cmd: Command, x: int, y: int, ex: int, ey: int, bypass_queue: bool = False):
+    def SendCommand(self, cmd: Command, x: int, y: int, ex: int, ey: int, bypass_queue: bool = False, data=None):
+        # Optional data (e.g. bitmap pixels) is sent right after the command, as part of the same request
         byteBuffer = bytearray(6)
         byteBuffer[0] = (x >> 2)
         byteBuffer[1] = (((x & 3) << 6) + (y >> 4))
@@ -66,12 +73,8 @@ class LcdCommRevA(LcdComm):
         byteBuffer[5] = cmd
 
         # If no queue for async requests, or if asked explicitly to do the request sequentially: do request now
-        if not self.update_queue or bypass_queue:
-            self.WriteData(byteBuffer)
-        else:
-            # Lock queue mutex then queue the request
-            with self.update_queue_mutex:
-                self.update_queue.put((self.WriteData, [byteBuffer]))
+        self.SendRequest(byteBuffer, data, region=(x, y, ex, ey) if data is not None else None,
+                         bypass_queue=bypass_queue)
 
     def InitializeComm(self):
         # HW revision A does not need init commands
@@ -81,6 +84,7 @@ class LcdCommRevA(LcdComm):
         logger.info("Display reset (COM port may change)...")
         # Reset command bypasses queue because it is run when queue threads are not yet started
         self.SendCommand(Command.RESET, 0, 0, 0, 0, bypass_queue=True)
+        self.InvalidateDisplayContent()
         self.closeSerial()
         # Wait for display reset then reconnect
         time.sleep(5)
@@ -89,6 +93,7 @@ class LcdCommRevA(LcdComm):
     def Clear(self):
         self.SetOrientation(Orientation.PORTRAIT)  # Bug: orientation needs to be PORTRAIT before clearing
         self.SendCommand(Command.CLEAR, 0, 0, 0, 0)
+        self.InvalidateDisplayContent()
         self.SetOrientation()  # Restore default orientation
 
     def ScreenOff(self):
@@ -112,7 +117,10 @@ class LcdCommRevA(LcdComm):
         pass
 
     def SetOrientation(self, orientation: Orientation = Orientation.PORTRAIT):
+        # Regions drawn in frame composition mode are sent with the orientation they were drawn for
+        self.Flush()
         self.orientation = orientation
+        self.InvalidateDisplayContent()
         width = self.get_width()
         height = self.get_height()
         x = 0
@@ -133,54 +141,5 @@ class LcdCommRevA(LcdComm):
         byteBuffer[10] = (height & 255)
         self.lcd_serial.write(bytes(byteBuffer))
 
-    def DisplayPILImage(
-            self,
-            image: Image,
-            x: int = 0, y: int = 0,
-            image_width: int = 0,
-            image_height: int = 0
-    ):
-        # If the image height/width isn't provided, use the native image size
-        if not image_height:
-            image_height = image.size[1]
-        if not image_width:
-            image_width = image.size[0]
-
-        # If our image is bigger than our display, resize it to fit our screen
-        if image.size[1] > self.get_height():
-            image_height = self.get_height()
-        if image.size[0] > self.get_width():
-            image_width = self.get_width()
-
-        assert x <= self.get_width(), 'Image X coordinate must be <= display width'
-        assert y <= self.get_height(), 'Image Y coordinate must be <= display height'
-        assert image_height > 0, 'Image height must be > 0'
-        assert image_width > 0, 'Image width must be > 0'
-
-        (x0, y0) = (x, y)
-        (x1, y1) = (x + image_width - 1, y + image_height - 1)
-
-        self.SendCommand(Command.DISPLAY_BITMAP, x0, y0, x1, y1)
-
-        pix = image.load()
-        line = bytes()
-
-        # Lock queue mutex then queue all the requests for the image data
-        with self.update_queue_mutex:
-            for h in range(image_height):
-                for w in range(image_width):
-                    R = pix[w, h][0] >> 3
-                    G = pix[w, h][1] >> 2
-                    B = pix[w, h][2] >> 3
-
-                    rgb = (R << 11) | (G << 5) | B
-                    line += struct.pack('H', rgb)
-
-                    # Send image data by multiple of DISPLAY_WIDTH bytes
-                    if len(line) >= self.get_width() * 8:
-                        self.SendLine(line)
-                        line = bytes()
-
-            # Write last line if needed
-            if len(line) > 0:
-                self.SendLine(line)
+    def SendBitmap(self, data, x0: int, y0: int, x1: int, y1: int):
+        self.SendCommand(Command.DISPLAY_BITMAP, x0, y0, x1, y1, data=data)
@@ -16,8 +16,6 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-import struct
-
 from serial.tools.list_ports import comports
 
 from library.lcd.lcd_comm import *
@@ -48,6 +46,23 @@ class SubRevision(IntEnum):
 
 
 class LcdCommRevB(LcdComm):
+    # Revision A: 0bRRRRRGGGGGGBBBBB
+    #               fedcba9876543210
+    # Revision B: 0bgggBBBBBRRRRRGGG
+    # That is...
+    #   High 3 bits of green in b0-b2
+    #   Low 3 bits of green in b13-b15
+    #   Red 5 bits in b3-b7
+    #   Blue 5 bits in b8-b12
+    # Once serialized, revision B format is the same as RGB565 big-endian
+    PIXEL_FORMAT = PixelFormat.RGB565_BE
+
+    # In revision B, the reverse orientations (reverse portrait / reverse landscape) are software-managed
+    SOFTWARE_REVERSE_ORIENTATION = True
+
+    # 10-byte DISPLAY_BITMAP packet
+    BITMAP_COMMAND_SIZE = 10
+
     def __init__(self, com_port: str = "AUTO", display_width: int = 320, display_height: int = 480,
                  update_queue: queue.Queue = None):
         LcdComm.__init__(self, com_port, display_width, display_height, update_queue)
@@ -74,8 +89,10 @@ class LcdCommRevB(LcdComm):
 
         return auto_com_port
 
-    def SendCommand(self, cmd: Command, payload=None, bypass_queue: bool = False):
+    def SendCommand(self, cmd: Command, payload=None, bypass_queue: bool = False, data=None,
+                    region: Tuple[int, int, int, int] = None):
         # New protocol (10 byte packets, framed with the command, 8 data bytes inside)
+        # Optional data (e.g. bitmap pixels for display region) is sent right after the command, in the same request
         if payload is None:
             payload = [0] * 8
         elif len(payload) < 8:
@@ -94,12 +111,7 @@ class LcdCommRevB(LcdComm):
         byteBuffer[9] = cmd
 
         # If no queue for async requests, or if asked explicitly to do the request sequentially: do request now
-        if not self.update_queue or bypass_queue:
-            self.WriteData(byteBuffer)
-        else:
-            # Lock queue mutex then queue the request
-            with self.update_queue_mutex:
-                self.update_queue.put((self.WriteData, [byteBuffer]))
+        self.SendRequest(byteBuffer, data, region, bypass_queue)
 
     def Hello(self):
         hello = [ord('H'), ord('E'), ord('L'), ord('L'), ord('O')]
@@ -184,80 +196,19 @@ class LcdCommRevB(LcdComm):
     def SetOrientation(self, orientation: Orientation = Orientation.PORTRAIT, new_width: int = 320, new_height: int = 480):
         # In revision B, basic orientations (portrait / landscape) are managed by the display
         # The reverse orientations (reverse portrait / reverse landscape) are software-managed
+        # Regions drawn in frame composition mode are sent with the orientation they were drawn for
+        self.Flush()
         self.orientation = orientation
+        self.InvalidateDisplayContent()
         if self.orientation == Orientation.PORTRAIT or self.orientation == Orientation.REVERSE_PORTRAIT:
             self.SendCommand(Command.SET_ORIENTATION, payload=[OrientationValueRevB.ORIENTATION_PORTRAIT])
         else:
             self.SendCommand(Command.SET_ORIENTATION, payload=[OrientationValueRevB.ORIENTATION_LANDSCAPE])
 
-    def DisplayPILImage(
-            self,
-            image: Image,
-            x: int = 0, y: int = 0,
-            image_width: int = 0,
-            image_height: int = 0
-    ):
-        # If the image height/width isn't provided, use the native image size
-        if not image_height:
-            image_height = image.size[1]
-        if not image_width:
-            image_width = image.size[0]
-
-        # If our image is bigger than our display, resize it to fit our screen
-        if image.size[1] > self.get_height():
-            image_height = self.get_height()
-        if image.size[0] > self.get_width():
-            image_width = self.get_width()
-
-        assert x <= self.get_width(), 'Image X coordinate must be <= display width'
-        assert y <= self.get_height(), 'Image Y coordinate must be <= display height'
-        assert image_height > 0, 'Image height must be > 0'
-        assert image_width > 0, 'Image width must be > 0'
-
-        if self.orientation == Orientation.PORTRAIT or self.orientation == Orientation.LANDSCAPE:
-            (x0, y0) = (x, y)
-            (x1, y1) = (x + image_width - 1, y + image_height - 1)
-        else:
-            (x0, y0) = (self.get_width() - x - image_width, self.get_height() - y - image_height)
-            (x1, y1) = (self.get_width() - x - 1, self.get_height() - y - 1)
-
+    def SendBitmap(self, data, x0: int, y0: int, x1: int, y1: int):
         self.SendCommand(Command.DISPLAY_BITMAP,
                          payload=[(x0 >> 8) & 255, x0 & 255,
                                   (y0 >> 8) & 255, y0 & 255,
                                   (x1 >> 8) & 255, x1 & 255,
-                                  (y1 >> 8) & 255, y1 & 255])
-        pix = image.load()
-        line = bytes()
-
-        # Lock queue mutex then queue all the requests for the image data
-        with self.update_queue_mutex:
-            for h in range(image_height):
-                for w in range(image_width):
-                    if self.orientation == Orientation.PORTRAIT or self.orientation == Orientation.LANDSCAPE:
-                        R = pix[w, h][0] >> 3
-                        G = pix[w, h][1] >> 2
-                        B = pix[w, h][2] >> 3
-                    else:
-                        R = pix[image_width - w - 1, image_height - h - 1][0] >> 3
-                        G = pix[image_width - w - 1, image_height - h - 1][1] >> 2
-                        B = pix[image_width - w - 1, image_height - h - 1][2] >> 3
-
-                    # Revision A: 0bRRRRRGGGGGGBBBBB
-                    #               fedcba9876543210
-                    # Revision B: 0bgggBBBBBRRRRRGGG
-                    # That is...
-                    #   High 3 bits of green in b0-b2
-                    #   Low 3 bits of green in b13-b15
-                    #   Red 5 bits in b3-b7
-                    #   Blue 5 bits in b8-b12
-                    rgb = (B << 8) | (G >> 3) | ((G & 7) << 13) | (R << 3)
-                    line += struct.pack('H', rgb)
-
-                    # Send image data by multiple of DISPLAY_WIDTH bytes
-                    if len(line) >= self.get_width() * 8:
-                        self.SendLine(line)
-                        line = bytes()
-
-            # Write last line if needed
-            if len(line) > 0:
-                self.SendLine(line)
+                                  (y1 >> 8) & 255, y1 & 255],
+                         data=data, region=(x0, y0, x1, y1))
@@ -54,6 +54,15 @@ class SimulatedLcdWebServer(BaseHTTPRequestHandler):
 
 # Simulated display: write on a file instead of serial port
 class LcdSimulated(LcdComm):
+    # Simulated display uses raw RGB pixels
+    PIXEL_FORMAT = PixelFormat.RGB888
+    SOFTWARE_REVERSE_ORIENTATION = False
+
+    # No command: bitmaps are directly pasted, but each one saves the whole screenshot file again
+    BITMAP_COMMAND_SIZE = 0
+    BITMAP_COMMAND_OVERHEAD = 100000
+    MAX_BITMAP_REQUEST_SIZE = 0
+
     def __init__(self, com_port: str = "AUTO", display_width: int = 320, display_height: int = 480,
                  update_queue: queue.Queue = None):
         LcdComm.__init__(self, com_port, display_width, display_height, update_queue)
@@ -95,38 +104,20 @@ class LcdSimulated(LcdComm):
         pass
 
     def SetOrientation(self, orientation: Orientation = Orientation.PORTRAIT):
+        # Regions drawn in frame composition mode are sent with the orientation they were drawn for
+        self.Flush()
         self.orientation = orientation
+        self.InvalidateDisplayContent()
         # Just draw the screen again with the new width/height based on orientation
         with self.update_queue_mutex:
             self.screen_image = Image.new("RGB", (self.get_width(), self.get_height()), (255, 255, 255))
             self.screen_image.save("tmp", "PNG")
             shutil.copyfile("tmp", SCREENSHOT_FILE)
 
-    def DisplayPILImage(
-            self,
-            image: Image,
-            x: int = 0, y: int = 0,
-            image_width: int = 0,
-            image_height: int = 0
-    ):
-        # If the image height/width isn't provided, use the native image size
-        if not image_height:
-            image_height = image.size[1]
-        if not image_width:
-            image_width = image.size[0]
-
-        # If our image is bigger than our display, resize it to fit our screen
-        if image.size[1] > self.get_height():
-            image_height = self.get_height()
-        if image.size[0] > self.get_width():
-            image_width = self.get_width()
-
-        assert x <= self.get_width(), 'Image X coordinate must be <= display width'
-        assert y <= self.get_height(), 'Image Y coordinate must be <= display height'
-        assert image_height > 0, 'Image height must be > 0'
-        assert image_width > 0, 'Image width must be > 0'
+    def SendBitmap(self, data, x0: int, y0: int, x1: int, y1: int):
+        image = Image.frombytes("RGB", (x1 - x0 + 1, y1 - y0 + 1), bytes(data))
 
         with self.update_queue_mutex:
-            self.screen_image.paste(image, (x, y))
+            self.screen_image.paste(image, (x0, y0))
             self.screen_image.save("tmp", "PNG")
             shutil.copyfile("tmp", SCREENSHOT_FILE)
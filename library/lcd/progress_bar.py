@@ -0,0 +1,74 @@
+# turing-smart-screen-python - a Python system monitor and library for 3.5" USB-C displays like Turing Smart Screen or XuanFang
+# https://github.com/mathoudebine/turing-smart-screen-python/
+
+# Copyright (C) 2021-2023  Matthieu Houdebine (mathoudebine)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# This file contains the sprites of progress bars: for each bar, an "empty" and a "full" bitmap are rendered once.
+# A bar with N filled columns is then composed of the N first columns of the full sprite, and the other columns of the
+# empty sprite. Composition is done directly on the bitmaps converted to the display pixel format
+
+from PIL import Image, ImageDraw
+
+from library.lcd.codec import PixelCodec
+
+
+class ProgressBarSprites:
+    def __init__(self, background: Image, bar_color, bar_outline: bool, codec: PixelCodec, rotate_180: bool = False):
+        # background is the bar background (solid color or crop of the background image), of the size of the bar
+        self.width, self.height = background.size
+        self.bytes_per_pixel = codec.bytes_per_pixel
+        self.rotate_180 = rotate_180
+
+        # Empty bar: background and outline
+        self.empty_image = background.copy()
+        if bar_outline:
+            ImageDraw.Draw(self.empty_image).rectangle([0, 0, self.width - 1, self.height - 1], fill=None,
+                                                       outline=bar_color)
+
+        # Full bar: the filled rectangle covers the whole bar, including the outline
+        self.full_image = Image.new('RGB', background.size, bar_color)
+
+        self.empty_data = bytes(codec.encode(self.empty_image, rotate_180))
+        self.full_data = bytes(codec.encode(self.full_image, rotate_180))
+
+    def get_image(self, filled_width: int) -> Image:
+        # Bar image with filled_width columns filled
+        image = self.empty_image.copy()
+        if filled_width > 0:
+            image.paste(self.full_image.crop((0, 0, filled_width, self.height)), (0, 0))
+        return image
+
+    def get_data(self, filled_width: int) -> bytearray:
+        # Bar bitmap in the display pixel format, with filled_width columns filled
+        data = bytearray(self.empty_data)
+        if filled_width > 0:
+            row_size = self.width * self.bytes_per_pixel
+            filled_size = filled_width * self.bytes_per_pixel
+            # Rotated bitmaps are serialized from the bottom-right: filled columns are at the end of each row
+            start = row_size - filled_size if self.rotate_180 else 0
+            for row in range(0, len(data), row_size):
+                data[row + start:row + start + filled_size] = self.full_data[row + start:row + start + filled_size]
+        return data
+
+    def get_strip_data(self, start: int, end: int, full: bool) -> bytearray:
+        # Columns [start, end) of the full or empty sprite, in the display pixel format
+        sprite_data = self.full_data if full else self.empty_data
+        row_size = self.width * self.bytes_per_pixel
+        if self.rotate_180:
+            # Rotated bitmaps are serialized from the bottom-right: columns are counted from the end of each row
+            (start, end) = (self.width - end, self.width - start)
+        (start, end) = (start * self.bytes_per_pixel, end * self.bytes_per_pixel)
+        return bytearray().join(sprite_data[row + start:row + end] for row in range(0, len(sprite_data), row_size))
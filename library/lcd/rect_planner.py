@@ -0,0 +1,162 @@
+# turing-smart-screen-python - a Python system monitor and library for 3.5" USB-C displays like Turing Smart Screen or XuanFang
+# https://github.com/mathoudebine/turing-smart-screen-python/
+
+# Copyright (C) 2021-2023  Matthieu Houdebine (mathoudebine)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# This file plans partial display updates: changed areas are merged into the set of rectangles that is the cheapest
+# to send, knowing that each bitmap command has a fixed cost (command packet + per-command latency of the link)
+
+from typing import Callable, List, Optional, Sequence, Tuple
+
+# Rectangle with inclusive coordinates: (x0, y0, x1, y1)
+Rect = Tuple[int, int, int, int]
+
+# Above this number of rectangles, pairwise merging is skipped to keep planning cheap
+MAX_MERGED_RECTANGLES = 24
+
+
+class CostModel:
+    # Cost of a bitmap command, in bytes sent on the serial link:
+    #   command_bytes + command_overhead + pixels * bytes_per_pixel
+    # command_overhead is the per-command latency of the link, converted to an equivalent number of bytes
+    def __init__(self, command_bytes: int, bytes_per_pixel: int, command_overhead: float = 0):
+        self.command_bytes = command_bytes
+        self.bytes_per_pixel = bytes_per_pixel
+        self.command_overhead = command_overhead
+
+    def cost(self, rect: Rect) -> float:
+        (x0, y0, x1, y1) = rect
+        return self.command_bytes + self.command_overhead + (x1 - x0 + 1) * (y1 - y0 + 1) * self.bytes_per_pixel
+
+    def calibrate(self, command_time: float, byte_time: float):
+        # Update the per-command overhead from measured link timings:
+        # mean time to write a command packet, and mean time to write one byte of bitmap data
+        if byte_time > 0:
+            self.command_overhead = max(0.0, command_time / byte_time - self.command_bytes)
+
+
+class WriteTimings:
+    # Least-squares fit of the serial link timings: write_time = commands * command_time + data_bytes * byte_time
+    # Each serial write is a sample, so batched writes mixing several commands and their data can be used
+    # Older samples are progressively forgotten, so that the fit follows the link state
+    DECAY = 0.99
+
+    def __init__(self):
+        # Weighted sums of the normal equations
+        self.cc = self.cd = self.dd = self.ct = self.dt = 0.0
+
+    def add(self, commands: int, data_bytes: int, write_time: float):
+        self.cc = self.cc * self.DECAY + commands * commands
+        self.cd = self.cd * self.DECAY + commands * data_bytes
+        self.dd = self.dd * self.DECAY + data_bytes * data_bytes
+        self.ct = self.ct * self.DECAY + commands * write_time
+        self.dt = self.dt * self.DECAY + data_bytes * write_time
+
+    def fit(self) -> Optional[Tuple[float, float]]:
+        # Return (command_time, byte_time), or None if the samples do not tell apart commands and data yet
+        det = self.cc * self.dd - self.cd * self.cd
+        if det <= 1e-6 * self.cc * self.dd:
+            return None
+        command_time = (self.ct * self.dd - self.dt * self.cd) / det
+        byte_time = (self.dt * self.cc - self.ct * self.cd) / det
+        if byte_time <= 0:
+            return None
+        return command_time, byte_time
+
+
+def _union(a: Rect, b: Rect) -> Rect:
+    return min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])
+
+
+def contains(a: Rect, b: Rect) -> bool:
+    return a[0] <= b[0] and a[1] <= b[1] and a[2] >= b[2] and a[3] >= b[3]
+
+
+def intersects(a: Rect, b: Rect) -> bool:
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+def plan_rectangles(bands: Sequence[Tuple[int, int, Sequence[Tuple[int, int]]]], cost_model: CostModel) -> List[Rect]:
+    # Plan the rectangles to send from a change mask split in horizontal bands (one band per tile row or pixel row)
+    # Each band is (y0, y1, spans) where spans are the sorted (x0, x1) ranges of changed pixels in the band
+    # Returned rectangles cover all changed pixels, and may also cover unchanged pixels when it is cheaper
+
+    # 1. Merge spans of each band horizontally, when sending the gap between them costs less than a new command
+    rects = []
+    for (y0, y1, spans) in bands:
+        current = None
+        for (x0, x1) in spans:
+            span = (x0, y0, x1, y1)
+            if current is None:
+                current = span
+            else:
+                merged = _union(current, span)
+                if cost_model.cost(merged) <= cost_model.cost(current) + cost_model.cost(span):
+                    current = merged
+                else:
+                    rects.append(current)
+                    current = span
+        if current is not None:
+            rects.append(current)
+
+    # 2. Merge vertically the rectangles with the same horizontal range in consecutive bands: always cheaper
+    rects.sort(key=lambda r: (r[0], r[2], r[1]))
+    merged_rects = []
+    for rect in rects:
+        last = merged_rects[-1] if merged_rects else None
+        if last is not None and last[0] == rect[0] and last[2] == rect[2] and last[3] + 1 == rect[1]:
+            merged_rects[-1] = (last[0], last[1], last[2], rect[3])
+        else:
+            merged_rects.append(rect)
+    rects = merged_rects
+
+    # 3. Greedily merge the rectangles when it is cheaper
+    return merge_rectangles(rects, cost_model)
+
+
+def merge_rectangles(rects: Sequence[Rect], cost_model: CostModel,
+                     can_merge: Callable[[Rect], bool] = None) -> List[Rect]:
+    # Greedily merge the pair of rectangles giving the best saving, until no merge is profitable
+    # If can_merge is set, rectangles are only merged when can_merge(union) is True
+    # Rectangles fully covered by another one are dropped. Returned rectangles are sorted from top to bottom
+    rects = list(rects)
+    if len(rects) > MAX_MERGED_RECTANGLES:
+        return rects
+
+    costs = [cost_model.cost(r) for r in rects]
+    while len(rects) > 1:
+        best = None
+        for i in range(len(rects)):
+            for j in range(i + 1, len(rects)):
+                union = _union(rects[i], rects[j])
+                saving = costs[i] + costs[j] - cost_model.cost(union)
+                if saving >= 0 and (best is None or saving > best[0]) and (can_merge is None or can_merge(union)):
+                    best = (saving, i, j, union)
+        if best is None:
+            break
+        (_, i, j, union) = best
+        del rects[j], costs[j]
+        rects[i] = union
+        costs[i] = cost_model.cost(union)
+
+        # Remove the rectangles now fully covered by the merged one
+        for k in range(len(rects) - 1, -1, -1):
+            if k != i and contains(union, rects[k]):
+                del rects[k], costs[k]
+                if k < i:
+                    i -= 1
+
+    return sorted(rects, key=lambda r: (r[1], r[0]))
@@ -0,0 +1,176 @@
+# turing-smart-screen-python - a Python system monitor and library for 3.5" USB-C displays like Turing Smart Screen or XuanFang
+# https://github.com/mathoudebine/turing-smart-screen-python/
+
+# Copyright (C) 2021-2023  Matthieu Houdebine (mathoudebine)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# This file converts PIL images to the pixel formats sent on the serial link to the displays.
+# Whole images are converted at once. Several interchangeable backends are available for RGB565 conversion:
+# - numpy: NumPy array operations (if NumPy is installed)
+# - pillow: Pillow channel lookup tables and raw packer, no extra dependency
+# - python: pure Python loop over the raw pixels buffer
+# select_fastest_backend() benchmarks the available backends on this host and uses the fastest one
+
+import time
+from typing import Dict, Iterator
+
+from PIL import Image, ImageChops
+
+# NumPy is optional: it greatly speeds up pixel conversion but is not mandatory
+try:
+    import numpy as np
+except:
+    np = None
+
+
+def image_to_RGB565(image: Image, endianness: str = "little", rotate_180: bool = False) -> memoryview:
+    # Convert a PIL image to a stream of RGB565 pixels: 0bRRRRRGGGGGGBBBBB, 2 bytes per pixel
+    # Pixels are serialized row by row, from top-left to bottom-right
+    # If rotate_180 is set, pixels are serialized from bottom-right to top-left (software-managed reverse orientations)
+    # The returned memoryview is a flat byte view of a single buffer allocated for the conversion
+    if image.mode != "RGB":
+        # We need the 3 channels to be R, G and B
+        image = image.convert("RGB")
+
+    return RGB565_BACKENDS[rgb565_backend](image, endianness, rotate_180)
+
+
+def _image_to_RGB565_numpy(image: Image, endianness: str, rotate_180: bool) -> memoryview:
+    rgb = np.asarray(image)
+    if rotate_180:
+        # Flipped view of the pixels array: no data is copied here
+        rgb = rgb[::-1, ::-1]
+
+    # Extract R, G, B channels and promote them to 16 bits
+    r = rgb[..., 0].astype(np.uint16)
+    g = rgb[..., 1].astype(np.uint16)
+    b = rgb[..., 2].astype(np.uint16)
+
+    # Construct RGB565
+    rgb565 = ((r >> 3) << 11) | ((g >> 2) << 5) | (b >> 3)
+
+    # Serialize to the requested endianness, without copying the result again to a bytes object
+    return memoryview(rgb565.astype("<u2" if endianness == "little" else ">u2")).cast("B")
+
+
+# Lookup tables to build the high/low bytes of RGB565 pixels from 8-bit R, G, B channels
+_R_TO_HIGH = [v & 0xF8 for v in range(256)]
+_G_TO_HIGH = [v >> 5 for v in range(256)]
+_G_TO_LOW = [(v << 3) & 0xE0 for v in range(256)]
+_B_TO_LOW = [v >> 3 for v in range(256)]
+
+
+def _image_to_RGB565_pillow(image: Image, endianness: str, rotate_180: bool) -> memoryview:
+    if rotate_180:
+        image = image.transpose(Image.Transpose.ROTATE_180)
+
+    # Build the high/low bytes of all pixels as 2 single-channel images. Bits of both operands never overlap,
+    # so the additions are equivalent to a binary OR
+    r, g, b = image.split()
+    high = ImageChops.add(r.point(_R_TO_HIGH), g.point(_G_TO_HIGH))
+    low = ImageChops.add(g.point(_G_TO_LOW), b.point(_B_TO_LOW))
+
+    # Interleave the 2 bytes of each pixel with the 2-channel "LA" raw packer
+    if endianness == "little":
+        return memoryview(Image.merge("LA", (low, high)).tobytes("raw", "LA"))
+    else:
+        return memoryview(Image.merge("LA", (high, low)).tobytes("raw", "LA"))
+
+
+def _image_to_RGB565_python(image: Image, endianness: str, rotate_180: bool) -> memoryview:
+    if rotate_180:
+        image = image.transpose(Image.Transpose.ROTATE_180)
+
+    rgb = image.tobytes()
+    rgb565 = bytearray(len(rgb) // 3 * 2)
+
+    # Byte positions of the high/low parts of each 16-bit pixel in the output buffer
+    (hi, lo) = (1, 0) if endianness == "little" else (0, 1)
+
+    i = 0
+    for p in range(0, len(rgb), 3):
+        r = rgb[p]
+        g = rgb[p + 1]
+        rgb565[i + hi] = (r & 0xF8) | (g >> 5)
+        rgb565[i + lo] = ((g << 3) & 0xE0) | (rgb[p + 2] >> 3)
+        i += 2
+
+    return memoryview(rgb565)
+
+
+# Available RGB565 conversion backends, from the usually fastest to the slowest
+RGB565_BACKENDS = {}
+if np is not None:
+    RGB565_BACKENDS["numpy"] = _image_to_RGB565_numpy
+RGB565_BACKENDS["pillow"] = _image_to_RGB565_pillow
+RGB565_BACKENDS["python"] = _image_to_RGB565_python
+
+# Backend currently used by image_to_RGB565()
+rgb565_backend = next(iter(RGB565_BACKENDS))
+
+# Backend timings measured by select_fastest_backend(), empty if the benchmark has not been run
+backend_timings = {}
+
+
+def set_backend(name: str):
+    global rgb565_backend
+    assert name in RGB565_BACKENDS, "Unknown or unavailable pixel conversion backend: " + name
+    rgb565_backend = name
+
+
+def select_fastest_backend(tile_size: int = 64, runs: int = 3) -> Dict[str, float]:
+    # Time each available backend on a small tile and use the fastest one
+    # Backends that do not give the same result as the reference python backend are discarded
+    # Return the best time (in seconds) of each valid backend
+    tile = Image.frombytes("RGB", (tile_size, tile_size), bytes(range(256)) * (tile_size * tile_size * 3 // 256 + 1))
+    reference = bytes(_image_to_RGB565_python(tile, "little", False))
+
+    timings = {}
+    for name, backend in RGB565_BACKENDS.items():
+        try:
+            if bytes(backend(tile, "little", False)) != reference:
+                continue
+            best = None
+            for _ in range(runs):
+                start = time.perf_counter()
+                backend(tile, "little", False)
+                elapsed = time.perf_counter() - start
+                if best is None or elapsed < best:
+                    best = elapsed
+            timings[name] = best
+        except Exception:
+            # Backend not usable on this host (e.g. incompatible library version)
+            continue
+
+    set_backend(min(timings, key=timings.get))
+    backend_timings.clear()
+    backend_timings.update(timings)
+    return timings
+
+
+def image_to_RGB888(image: Image, rotate_180: bool = False) -> memoryview:
+    # Convert a PIL image to a stream of raw RGB pixels, 3 bytes per pixel
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    if rotate_180:
+        image = image.transpose(Image.Transpose.ROTATE_180)
+    return memoryview(image.tobytes())
+
+
+def iter_chunks(data, chunk_size: int) -> Iterator[memoryview]:
+    # Split a buffer in chunks of chunk_size bytes (last one may be shorter), without copying data
+    view = memoryview(data)
+    for i in range(0, len(view), chunk_size):
+        yield view[i:i + chunk_size]
@@ -0,0 +1,167 @@
+# turing-smart-screen-python - a Python system monitor and library for 3.5" USB-C displays like Turing Smart Screen or XuanFang
+# https://github.com/mathoudebine/turing-smart-screen-python/
+
+# Copyright (C) 2021-2023  Matthieu Houdebine (mathoudebine)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# This file contains the queue of requests to send to the display, with latest-wins coalescing of bitmap updates:
+# a pending bitmap request is dropped when a newer request covering its whole display region is queued, as its pixels
+# would be overwritten anyway. If the serial link falls behind, only the latest content of each region is sent.
+# Requests also have a priority and an optional deadline: more urgent bitmap requests are sent before the others,
+# as long as they do not overlap a bitmap request queued before them
+
+import queue
+from collections import deque
+
+from library.lcd.rect_planner import contains, intersects
+
+# Request priorities: large transfers (e.g. backgrounds, sent by bands) are low priority, requests with a deadline
+# (e.g. clock) are urgent
+PRIORITY_LOW = 0
+PRIORITY_NORMAL = 1
+PRIORITY_URGENT = 2
+
+# Maximum number of queued requests considered to find the next one to send
+MAX_REORDER_WINDOW = 64
+
+
+def _get_urgency(entry):
+    # Lower is more urgent: priority first, then earliest deadline
+    (region, item, priority, deadline) = entry
+    return -priority, deadline if deadline is not None else float("inf")
+
+
+class UpdateQueue(queue.Queue):
+    # Queue of (function, args) requests, like queue.Queue
+    # Requests can be queued with the display region (x0, y0, x1, y1) they update: put(item, region=(x0, y0, x1, y1))
+    # Requests queued without region (other commands) are never dropped nor reordered, and are barriers for coalescing
+    # and priorities: requests queued before them are never dropped by requests queued after them, and are all sent
+    # before them
+    # Requests with a region are sent by priority, then by deadline (time.monotonic() time), then in queued order.
+    # A request is never sent before a request queued before it for an overlapping region
+
+    def put(self, item, block=True, timeout=None, region=None, priority=PRIORITY_NORMAL, deadline=None):
+        super().put((region, item, priority, deadline), block, timeout)
+
+    def get_all(self, block=True):
+        # Wait until at least one request is queued, then remove and return the queued requests in a list, in the order
+        # they must be sent. Stop after the first low priority request, so that requests queued while it is being
+        # sent can be sent before the next low priority ones
+        # If block is False, return immediately (possibly an empty list)
+        # Call task_done() for each of them once processed
+        with self.not_empty:
+            while block and not self._qsize():
+                self.not_empty.wait()
+            items = []
+            while self._qsize():
+                (item, priority) = self._get_next()
+                items.append(item)
+                if priority == PRIORITY_LOW:
+                    break
+            self.not_full.notify_all()
+            return items
+
+    def wait_requests(self):
+        # Wait until at least one request is queued, without removing it
+        with self.not_empty:
+            while not self._qsize():
+                self.not_empty.wait()
+
+    def has_deadline(self) -> bool:
+        # True if a queued request has a deadline
+        with self.mutex:
+            return any(entry[1] is not None and entry[3] is not None for entry in self.queue)
+
+    def _init(self, maxsize):
+        # Queued entries are [region, item, priority, deadline] lists: item is set to None when the entry is dropped,
+        # or sent before the entries queued before it
+        self.queue = deque()
+        # Entries queued with a region since the last barrier, that have not been dropped or retrieved yet
+        self.pending = []
+        self.size = 0
+        # Number of requests dropped because a newer request replaced them
+        self.coalesced = 0
+
+    def _qsize(self):
+        return self.size
+
+    def _put(self, entry):
+        entry = list(entry)
+        region = entry[0]
+
+        if region is None:
+            self.pending.clear()
+        else:
+            pending = []
+            for old in self.pending:
+                if contains(region, old[0]):
+                    # Latest wins: older request will not be sent
+                    old[1] = None
+                    self.size -= 1
+                    self.unfinished_tasks -= 1
+                    self.coalesced += 1
+                else:
+                    pending.append(old)
+            pending.append(entry)
+            self.pending = pending
+
+        self.queue.append(entry)
+        self.size += 1
+
+    def _get(self):
+        return self._get_next()[0]
+
+    def _get_next(self):
+        # Entries dropped or already sent at the head of the queue
+        while self.queue[0][1] is None:
+            self.queue.popleft()
+
+        entry = self._select()
+        item = entry[1]
+        if entry is self.queue[0]:
+            self.queue.popleft()
+        else:
+            # Sent before older requests: entry stays in the queue, marked as sent
+            entry[1] = None
+        self.size -= 1
+
+        # Request is about to be sent: it cannot be replaced anymore
+        for i, pending in enumerate(self.pending):
+            if pending is entry:
+                del self.pending[i]
+                break
+
+        return item, entry[2]
+
+    def _select(self):
+        # Most urgent request among the ones queued before the first barrier, that does not overlap a request queued
+        # before it. Queue head is always a candidate
+        selected = self.queue[0]
+        if selected[0] is None:
+            return selected
+        selected_urgency = _get_urgency(selected)
+
+        older_regions = []
+        for entry in self.queue:
+            if entry[1] is None:
+                continue
+            if entry[0] is None or len(older_regions) >= MAX_REORDER_WINDOW:
+                break
+            urgency = _get_urgency(entry)
+            if urgency < selected_urgency and not any(intersects(entry[0], region) for region in older_regions):
+                (selected, selected_urgency) = (entry, urgency)
+            older_regions.append(entry[0])
+
+        return selected
@@ -18,17 +18,440 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import asyncio
+import heapq
+import math
+import queue
 import sched
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
 from functools import wraps
 
 import library.config as config
 import library.stats as stats
+from library.display import display
+from library.log import logger
 
 STOPPING = False
 
+# Scheduler mode:
+# - THREADS: each periodic job runs in its own thread, with its own scheduler
+# - SINGLE: one thread owns the timers of all periodic jobs, and dispatches them to a small pool of worker threads
+# - ASYNCIO: one asyncio event loop runs all periodic jobs as coroutines, and the task sending requests to the display
+SCHEDULER = str(config.CONFIG_DATA["config"].get("SCHEDULER", "THREADS")).upper()
+SCHEDULER_WORKERS = config.CONFIG_DATA["config"].get("SCHEDULER_WORKERS", 2)
+
+# Base tick of the SINGLE and ASYNCIO schedulers, in seconds (0 to disable): job intervals are rounded to multiples of
+# the tick, and jobs run on wall-clock tick boundaries. Jobs due on the same tick run together, and the requests they
+# queue are sent to the display in one batch
+SCHEDULER_TICK = config.CONFIG_DATA["config"].get("SCHEDULER_TICK", 0) if SCHEDULER in ("SINGLE", "ASYNCIO") else 0
+
+# Number of requests waiting in the update queue above which the display link is considered saturated
+MAX_PENDING_REQUESTS = 64
+
+
+def get_tick_interval(interval: float) -> float:
+    # Job interval rounded to a multiple of the tick (at least one tick)
+    if not SCHEDULER_TICK:
+        return interval
+    return max(1, round(interval / SCHEDULER_TICK)) * SCHEDULER_TICK
+
+
+def align_to_tick(run_time: float) -> float:
+    # First tick boundary of the wall clock at or after a time.monotonic() time
+    if not SCHEDULER_TICK:
+        return run_time
+    offset = time.time() - time.monotonic()
+    # Small margin so that a time already on a tick boundary is not moved to the next one by rounding errors
+    return math.ceil((run_time + offset) / SCHEDULER_TICK - 1e-6) * SCHEDULER_TICK - offset
+
+
+def get_next_run(previous_run: float, interval: float, now: float) -> float:
+    # Next run time is based on the previous one so that jobs do not drift: a job finishing a bit after its next due
+    # time runs again immediately. If the job is late by more than one interval, missed runs are not caught up
+    next_run = previous_run + interval
+    if next_run < now - interval:
+        next_run = now
+    return align_to_tick(next_run)
+
+
+class TickBatch:
+    """ Jobs started on the current tick that are still running: queued requests are sent once all of them are done """
+
+    def __init__(self):
+        # Due time of the current tick (time.monotonic() time), and number of its jobs still running
+        self.tick_time = float("-inf")
+        self.running = 0
+        self.condition = threading.Condition()
+
+    def _is_current_tick(self, tick_time: float) -> bool:
+        return abs(tick_time - self.tick_time) < SCHEDULER_TICK / 2
+
+    def begin(self, tick_time: float):
+        # A job due at tick_time starts: jobs still running from previous ticks are not waited for anymore
+        with self.condition:
+            if not self._is_current_tick(tick_time):
+                self.tick_time = tick_time
+                self.running = 0
+            self.running += 1
+
+    def done(self, tick_time: float):
+        with self.condition:
+            if self._is_current_tick(tick_time) and self.running > 0:
+                self.running -= 1
+            self.condition.notify_all()
+
+    def wait(self, stop):
+        # Wait for the jobs of the current tick, but not after the end of the tick, nor once stop() returns True
+        with self.condition:
+            timeout = self.tick_time + SCHEDULER_TICK - time.monotonic()
+            if timeout > 0:
+                self.condition.wait_for(lambda: self.running == 0 or stop(), timeout)
+
+
+tick_batch = TickBatch()
+
+
+class JobMonitor:
+    """ Deadline tracking of a periodic job: late starts, overruns, and effective interval """
+
+    # Maximum stretch of the effective interval of a job, relative to its configured interval
+    MAX_BACKOFF = 8
+
+    def __init__(self, name: str, interval: float, sampling: bool = False):
+        self.name = name
+        self.interval = get_tick_interval(interval)
+        # Time each run intentionally spends sampling its sensor (e.g. CPU percentage measured over the job interval):
+        # it is not counted as work when detecting overruns
+        self.sampling_time = interval if sampling else 0.0
+        # Interval actually used: stretched when the job overruns or when the display link is saturated
+        self.effective_interval = self.interval
+
+        self.created = time.monotonic()
+        self.runs = 0
+        # Runs started more than 10% of the interval after their due time (or after the end of the previous run)
+        self.late_starts = 0
+        # Runs longer than the effective interval, sampling time excluded
+        self.overruns = 0
+        # Runs skipped because the previous one was not finished
+        self.skipped = 0
+        self.last_duration = 0.0
+        self.max_duration = 0.0
+        self.last_work_duration = 0.0
+        self.last_end = 0.0
+
+    def start(self, due_time: float) -> float:
+        start = time.monotonic()
+        # A run cannot start before the end of the previous one: that delay is counted as an overrun, not a late start
+        if start - max(due_time, self.last_end) > 0.1 * self.interval:
+            self.late_starts += 1
+        return start
+
+    def finish(self, start: float):
+        self.runs += 1
+        self.last_end = time.monotonic()
+        self.last_duration = self.last_end - start
+        self.max_duration = max(self.max_duration, self.last_duration)
+        self.last_work_duration = max(0.0, self.last_duration - self.sampling_time)
+
+        if self.runs == 1:
+            # First run includes one-time initializations (fonts, caches...): it is not used to detect overruns
+            return
+
+        pending_requests = config.update_queue.qsize()
+        if self.last_work_duration > self.effective_interval:
+            self.overruns += 1
+            self.back_off("last run took %.3fs" % self.last_duration)
+        elif pending_requests > MAX_PENDING_REQUESTS:
+            self.back_off("%d requests pending for the display" % pending_requests)
+        elif self.effective_interval > self.interval and self.last_work_duration < self.effective_interval / 2:
+            # Recovered: go back progressively to the configured interval
+            self.set_effective_interval(max(self.effective_interval / 2, self.interval))
+
+    def skip(self):
+        self.skipped += 1
+        self.overruns += 1
+        self.back_off("previous run not finished")
+
+    def back_off(self, reason: str):
+        # Run the job less often until the sensor or the display link keeps up again
+        interval = get_tick_interval(min(self.effective_interval * 2, self.interval * self.MAX_BACKOFF))
+        if self.effective_interval == self.interval:
+            logger.warning("Job %s cannot keep up (%s): interval stretched to %.2fs" % (self.name, reason, interval))
+        self.set_effective_interval(interval)
+
+    def set_effective_interval(self, interval: float):
+        interval = get_tick_interval(interval)
+        if interval == self.interval and self.effective_interval != self.interval:
+            logger.info("Job %s keeps up again: back to its %.2fs interval" % (self.name, interval))
+        self.effective_interval = interval
+
+    def get_next_run(self, previous_run: float, now: float) -> float:
+        return get_next_run(previous_run, self.effective_interval, now)
+
+    def get_rates(self) -> dict:
+        elapsed = time.monotonic() - self.created
+        return {
+            'interval': self.interval,
+            'effective_interval': self.effective_interval,
+            'effective_rate': 1 / self.effective_interval if self.effective_interval else 0,
+            'measured_rate': self.runs / elapsed if elapsed else 0,
+            'runs': self.runs,
+            'late_starts': self.late_starts,
+            'overruns': self.overruns,
+            'skipped': self.skipped,
+            'max_duration': self.max_duration,
+        }
+
+
+# Deadline tracking of all periodic jobs: job name -> JobMonitor
+job_monitors = {}
+
+
+def get_job_monitor(name: str, interval: float, sampling: bool = False) -> JobMonitor:
+    monitor = JobMonitor(name, interval, sampling)
+    job_monitors[name] = monitor
+    return monitor
+
+
+def get_job_rates() -> dict:
+    """ Effective rates of all periodic jobs: job name -> rates and deadline statistics """
+    return {name: monitor.get_rates() for name, monitor in job_monitors.items()}
+
+
+class TimerScheduler:
+    """ Single thread dispatching all periodic jobs, ordered by next run time in a heap """
+
+    def __init__(self, workers: int):
+        # Heap of (next run time, job sequence number, job)
+        self.timers = []
+        self.sequence = 0
+        self.condition = threading.Condition()
+        self.thread = None
+
+        # Jobs that may block (sensor reading...) run in worker threads, so that they do not delay other jobs
+        self.jobs = queue.Queue()
+        for i in range(workers):
+            threading.Thread(target=self.run_worker, name="Scheduler_Worker_%d" % i).start()
+
+        # Sequence numbers of the jobs currently running in a worker thread
+        self.running = set()
+        # Runs that became due while the previous run of the same job was still running: sequence number -> run
+        # They start as soon as the previous run is finished
+        self.deferred = {}
+        self.running_mutex = threading.Lock()
+
+    def add(self, name: str, interval: float, func, blocking: bool = True, sampling: bool = False):
+        """ Register a periodic job: it runs now (or at the next tick), then every interval seconds """
+        with self.condition:
+            heapq.heappush(self.timers, (align_to_tick(time.monotonic()), self.sequence,
+                                         (get_job_monitor(name, interval, sampling), func, blocking)))
+            self.sequence += 1
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="Scheduler")
+                self.thread.start()
+            self.condition.notify()
+
+    def run(self):
+        while not STOPPING:
+            with self.condition:
+                now = time.monotonic()
+                if not self.timers or self.timers[0][0] > now:
+                    # Sleep until the next job is due, or a new job is added
+                    self.condition.wait(self.timers[0][0] - now if self.timers else None)
+                    continue
+
+                # All due jobs are dispatched together (with ticks: all jobs of the tick)
+                due_jobs = []
+                while self.timers and self.timers[0][0] <= now:
+                    due_time, sequence, job = heapq.heappop(self.timers)
+                    heapq.heappush(self.timers, (job[0].get_next_run(due_time, now), sequence, job))
+                    due_jobs.append((due_time, sequence, job))
+
+            started_jobs = []
+            for due_time, sequence, (monitor, func, blocking) in due_jobs:
+                with self.running_mutex:
+                    if not blocking or sequence not in self.running:
+                        # Jobs sampling their sensor over their interval span several ticks: they are not part of the
+                        # tick batch
+                        in_tick = bool(SCHEDULER_TICK) and not monitor.sampling_time
+                        started_jobs.append((due_time, sequence, monitor, func, blocking, in_tick))
+                    elif sequence not in self.deferred:
+                        # Previous run is not finished yet (e.g. sensor sampled over the job interval): this run
+                        # starts as soon as it is finished
+                        self.deferred[sequence] = (due_time, monitor, func)
+                    else:
+                        # A run is already waiting for the previous one: skip this one
+                        logger.debug("Job %s is still running, skipping this run" % monitor.name)
+                        monitor.skip()
+
+            # All jobs of the tick begin before any of them runs
+            for due_time, sequence, monitor, func, blocking, in_tick in started_jobs:
+                if in_tick:
+                    tick_batch.begin(due_time)
+            for due_time, sequence, monitor, func, blocking, in_tick in started_jobs:
+                if blocking:
+                    with self.running_mutex:
+                        self.running.add(sequence)
+                    self.jobs.put((due_time, sequence, monitor, func, in_tick))
+                else:
+                    self._run_job(monitor, func, due_time, in_tick)
+
+    def run_worker(self):
+        while True:
+            due_time, sequence, monitor, func, in_tick = self.jobs.get()
+            self._run_job(monitor, func, due_time, in_tick)
+            with self.running_mutex:
+                deferred = self.deferred.pop(sequence, None)
+                if deferred is None:
+                    self.running.discard(sequence)
+            if deferred is not None:
+                # Job stays running: its deferred run starts now, out of its tick
+                (due_time, monitor, func) = deferred
+                self.jobs.put((due_time, sequence, monitor, func, False))
+
+    @staticmethod
+    def _run_job(monitor: JobMonitor, func, due_time: float, in_tick: bool = False):
+        start = monitor.start(due_time)
+        try:
+            func()
+        except Exception as e:
+            # An exception must not stop the scheduler thread, nor the other jobs
+            logger.error("Exception in job %s: %s" % (monitor.name, str(e)))
+        finally:
+            monitor.finish(start)
+            if in_tick:
+                tick_batch.done(due_time)
+
+
+class AsyncioScheduler:
+    """ One asyncio event loop running all periodic jobs, and the writer task sending queued requests to the display """
+
+    def __init__(self, workers: int):
+        self.loop = asyncio.new_event_loop()
+        self.job_tasks = []
+        self.writer_task = None
+
+        # Jobs that may block (sensor reading...) run in an executor, so that they do not block the event loop.
+        # Serial writes have their own executor, so that they do not wait for jobs
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="Job_Worker")
+        self.writer_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="Queue_Writer")
+
+        # Notified by the writer task each time queued requests have been sent
+        self.writer_progress = None
+
+        self.thread = threading.Thread(target=self.run, name="Event_Loop")
+        self.thread.start()
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def add(self, name: str, interval: float, func, blocking: bool = True, sampling: bool = False):
+        """ Register a periodic job: it runs now, then every interval seconds """
+        self.loop.call_soon_threadsafe(self._create_job_task, get_job_monitor(name, interval, sampling), func,
+                                       blocking)
+
+    def start_writer(self):
+        """ Start the task sending the queued requests to the display """
+        self.loop.call_soon_threadsafe(self._create_writer_task)
+
+    def cancel_jobs(self):
+        """ Cancel all periodic jobs now: the writer task keeps sending the queued requests """
+        self.loop.call_soon_threadsafe(self._cancel_jobs)
+
+    def _create_job_task(self, monitor: JobMonitor, func, blocking: bool):
+        self.job_tasks.append(self.loop.create_task(self._run_periodic(monitor, func, blocking)))
+
+    def _create_writer_task(self):
+        self.writer_task = self.loop.create_task(self._run_writer())
+
+    def _cancel_jobs(self):
+        for task in self.job_tasks:
+            task.cancel()
+
+    def _get_writer_progress(self) -> asyncio.Condition:
+        # Created from the event loop, as asyncio primitives are bound to the loop of their creation on old Python
+        if self.writer_progress is None:
+            self.writer_progress = asyncio.Condition()
+        return self.writer_progress
+
+    async def _run_periodic(self, monitor: JobMonitor, func, blocking: bool):
+        next_run = align_to_tick(self.loop.time())
+        await asyncio.sleep(next_run - self.loop.time())
+        while True:
+            # Backpressure: do not render new content while the display link is saturated
+            writer_progress = self._get_writer_progress()
+            async with writer_progress:
+                await writer_progress.wait_for(lambda: config.update_queue.qsize() <= MAX_PENDING_REQUESTS)
+
+            # Jobs of the same tick wake up in the same event loop iteration: they all begin before any of them runs
+            # Jobs sampling their sensor over their interval span several ticks: they are not part of the tick batch
+            in_tick = SCHEDULER_TICK and not monitor.sampling_time
+            if in_tick:
+                tick_batch.begin(next_run)
+            start = monitor.start(next_run)
+            try:
+                if blocking:
+                    await self.loop.run_in_executor(self.executor, func)
+                else:
+                    func()
+            except Exception as e:
+                # An exception must not stop the event loop, nor the other jobs
+                logger.error("Exception in job %s: %s" % (monitor.name, str(e)))
+            finally:
+                monitor.finish(start)
+                if in_tick:
+                    tick_batch.done(next_run)
+
+            # Next run is due one interval after the due time of this one, not after its end: a run lasting its whole
+            # interval (e.g. CPU percentage sampled over the interval) is followed immediately by the next one
+            next_run = monitor.get_next_run(next_run, self.loop.time())
+            await asyncio.sleep(max(0.0, next_run - self.loop.time()))
+
+    async def _run_writer(self):
+        writer_progress = self._get_writer_progress()
+        while True:
+            await self.loop.run_in_executor(self.writer_executor, write_queued_requests)
+            async with writer_progress:
+                writer_progress.notify_all()
+
+
+timer_scheduler = None
+asyncio_scheduler = None
+
+
+def get_job_scheduler():
+    # Shared scheduler of the periodic jobs, for the SINGLE and ASYNCIO modes
+    global timer_scheduler, asyncio_scheduler
+    if SCHEDULER == "ASYNCIO":
+        if asyncio_scheduler is None:
+            asyncio_scheduler = AsyncioScheduler(SCHEDULER_WORKERS)
+        return asyncio_scheduler
+    else:
+        if timer_scheduler is None:
+            timer_scheduler = TimerScheduler(SCHEDULER_WORKERS)
+        return timer_scheduler
+
+
+def stop():
+    """ Stop running periodic jobs: requests already queued are still sent to the display """
+    global STOPPING
+    STOPPING = True
+    if asyncio_scheduler is not None:
+        asyncio_scheduler.cancel_jobs()
+    if timer_scheduler is not None:
+        with timer_scheduler.condition:
+            timer_scheduler.condition.notify()
+
+
+def join():
+    """ In ASYNCIO mode, wait for the event loop: its executors cannot start jobs once the main thread has exited """
+    if asyncio_scheduler is not None:
+        asyncio_scheduler.thread.join()
+
 
 def async_job(threadname=None):
     """ wrapper to handle asynchronous threads """
@@ -39,6 +462,13 @@ def async_job(threadname=None):
         @wraps(func)
         def async_func(*args, **kwargs):
             """ create an asynchronous function to wrap around our thread """
+            if SCHEDULER in ("SINGLE", "ASYNCIO") and hasattr(func, "periodic_job"):
+                # Periodic job is registered in the shared scheduler instead of running in its own thread
+                job_scheduler = get_job_scheduler()
+                (interval, job, blocking, sampling) = func.periodic_job
+                job_scheduler.add(threadname, interval, lambda: job(*args, **kwargs), blocking, sampling)
+                return job_scheduler.thread
+
             func_hl = threading.Thread(target=func, name=threadname, args=args, kwargs=kwargs)
             func_hl.start()
             return func_hl
@@ -48,20 +478,24 @@ def async_job(threadname=None):
     return decorator
 
 
-def schedule(interval):
+def schedule(interval, blocking=True, sampling=False):
     """ wrapper to schedule asynchronous threads """
 
     def decorator(func):
         """ Decorator to extend periodic """
 
-        def periodic(scheduler, periodic_interval, action, actionargs=()):
+        def periodic(scheduler, monitor, due_time, action, actionargs=()):
             """ Wrap the scheduler with our periodic interval """
             global STOPPING
+            start = monitor.start(due_time)
+            action(*actionargs)
+            monitor.finish(start)
             if not STOPPING:
                 # If the program is not stopping: re-schedule the task for future execution
-                scheduler.enter(periodic_interval, 1, periodic,
-                                (scheduler, periodic_interval, action, actionargs))
-            action(*actionargs)
+                # Next run is planned from the due time of this one once it is finished, so that runs longer than the
+                # interval do not pile up
+                next_run = monitor.get_next_run(due_time, time.monotonic())
+                scheduler.enterabs(next_run, 1, periodic, (scheduler, monitor, next_run, action, actionargs))
 
         @wraps(func)
         def wrap(
@@ -69,17 +503,22 @@ def schedule(interval):
                 **kwargs
         ):
             """ Wrapper to create our schedule and run it at the appropriate time """
-            scheduler = sched.scheduler(time.time, time.sleep)
-            periodic(scheduler, interval, func)
+            scheduler = sched.scheduler(time.monotonic, time.sleep)
+            monitor = get_job_monitor(threading.current_thread().name, interval, sampling)
+            periodic(scheduler, monitor, time.monotonic(), func)
             scheduler.run()
 
+        # Used by the shared schedulers: jobs that cannot block run directly in their thread
+        # Sampling jobs block for their own interval on purpose (see JobMonitor)
+        wrap.periodic_job = (interval, func, blocking, sampling)
         return wrap
 
     return decorator
 
 
 @async_job("CPU_Percentage")
-@schedule(timedelta(seconds=config.THEME_DATA['STATS']['CPU']['PERCENTAGE'].get("INTERVAL", None)).total_seconds())
+@schedule(timedelta(seconds=config.THEME_DATA['STATS']['CPU']['PERCENTAGE'].get("INTERVAL", None)).total_seconds(),
+          sampling=True)
 def CPUPercentage():
     """ Refresh the CPU Percentage """
     # logger.debug("Refresh CPU Percentage")
@@ -102,7 +541,7 @@ def CPULoad():
     stats.CPU.load()
 
 
-@async_job("CPU_Load")
+@async_job("CPU_Temperature")
 @schedule(timedelta(seconds=config.THEME_DATA['STATS']['CPU']['TEMPERATURE'].get("INTERVAL", None)).total_seconds())
 def CPUTemperature():
     """ Refresh the CPU Temperature """
@@ -140,28 +579,54 @@ def NetStats():
 
 
 @async_job("Date_Stats")
-@schedule(timedelta(seconds=config.THEME_DATA['STATS']['DATE'].get("INTERVAL", None)).total_seconds())
+@schedule(timedelta(seconds=config.THEME_DATA['STATS']['DATE'].get("INTERVAL", None)).total_seconds(),
+          blocking=False)
 def DateStats():
     # logger.debug("Refresh date stats")
     stats.Date.stats()
 
 
+@async_job("Display_Flush")
+@schedule(timedelta(seconds=config.CONFIG_DATA["display"].get("FRAME_FLUSH_INTERVAL", 0.1)).total_seconds(),
+          blocking=False)
+def DisplayFlush():
+    # Send the regions of the screen updated by widgets since last flush (frame composition mode)
+    display.lcd.Flush()
+
+
+def write_queued_requests():
+    # Wait for requests, then send all queued requests at once: their serial writes are merged into larger ones
+    if SCHEDULER_TICK:
+        # Wait for the other jobs started on the same tick, to send all their requests in the same batch.
+        # Requests with a deadline (e.g. clock) are sent without waiting
+        config.update_queue.wait_requests()
+        tick_batch.wait(config.update_queue.has_deadline)
+    requests = config.update_queue.get_all()
+    display.lcd.BeginWriteBatch()
+    try:
+        for f, args in requests:
+            if f:
+                f(*args)
+    finally:
+        display.lcd.EndWriteBatch()
+        for _ in requests:
+            config.update_queue.task_done()
+
+
 @async_job("Queue_Handler")
-@schedule(timedelta(milliseconds=1).total_seconds())
+def QueueHandlerThread():
+    while True:
+        write_queued_requests()
+
+
 def QueueHandler():
-    # Do next action waiting in the queue
-    global STOPPING
-    if STOPPING:
-        # Empty the action queue to allow program to exit cleanly
-        while not config.update_queue.empty():
-            f, args = config.update_queue.get()
-            f(*args)
+    # Send the requests queued by the jobs to the display
+    if SCHEDULER == "ASYNCIO":
+        get_job_scheduler().start_writer()
     else:
-        # Execute first action in the queue
-        f, args = config.update_queue.get()
-        if f:
-            f(*args)
+        QueueHandlerThread()
 
 
 def is_queue_empty() -> bool:
-    return config.update_queue.empty()
+    # Requests retrieved by the queue handler are only done once they have been written to the display
+    return config.update_queue.unfinished_tasks == 0
@@ -26,6 +26,7 @@ import math
 import os
 import platform
 import sys
+import time
 
 import babel.dates
 #from psutil._common import bytes2human
@@ -132,6 +133,21 @@ def format_number(num, sectionConfig, unit, bytes = False) -> str:
     
     return string
     
+# Last state displayed by each widget (text, style, bar filled width...), indexed by widget type and position
+# Widgets are only rendered and sent to the display when their state changes
+WIDGETS_LAST_STATE = {}
+
+
+def widget_state_changed(widget, state) -> bool:
+    # Return True if the new state of the widget is different from the last displayed one
+    return WIDGETS_LAST_STATE.get(widget) != state
+
+
+def set_widget_state(widget, state):
+    # Store the state of the widget once it has been displayed: if displaying it failed, it is displayed again next time
+    WIDGETS_LAST_STATE[widget] = state
+
+
 def text_factory(text, value, sectionConfig):
     
     tempConfig = sectionConfig.copy()
@@ -143,7 +159,7 @@ def text_factory(text, value, sectionConfig):
                     continue
                 tempConfig[key] = tempConfig['TRESHOLD'][key]
     
-    display.lcd.DisplayText(
+    text_args = dict(
         text=text,
         x=tempConfig.get("X", 0),
         y=tempConfig.get("Y", 0),
@@ -153,6 +169,11 @@ def text_factory(text, value, sectionConfig):
         background_color=tempConfig.get("BACKGROUND_COLOR", config.THEME_DEFAULTS['TEXT_BACKGROUND_COLOR']),
         background_image=get_full_path(config.THEME_DATA['PATH'], tempConfig.get("BACKGROUND_IMAGE", config.THEME_DEFAULTS['TEXT_BACKGROUND_IMAGE']))
     )
+
+    # Only display the text if it or its resolved style changed since last time
+    if widget_state_changed(("TEXT", text_args['x'], text_args['y']), text_args):
+        display.lcd.DisplayText(**text_args)
+        set_widget_state(("TEXT", text_args['x'], text_args['y']), text_args)
     
     del tempConfig
 
@@ -167,7 +188,7 @@ def bar_factory(value, sectionConfig):
                     continue
                 tempConfig[key] = tempConfig['TRESHOLD'][key]
     
-    display.lcd.DisplayProgressBar(
+    bar_args = dict(
         x=tempConfig.get("X", 0),
         y=tempConfig.get("Y", 0),
         width=tempConfig.get("WIDTH", 0),
@@ -180,6 +201,17 @@ def bar_factory(value, sectionConfig):
         background_color=tempConfig.get("BACKGROUND_COLOR", config.THEME_DEFAULTS['BAR_BACKGROUND_COLOR']),
         background_image=get_full_path(config.THEME_DATA['PATH'], tempConfig.get("BACKGROUND_IMAGE", config.THEME_DEFAULTS['BAR_BACKGROUND_IMAGE']))
     )
+
+    # The bar is drawn the same way for all values giving the same number of filled pixel columns
+    bar_state = dict(bar_args)
+    bar_state['value'] = display.lcd.get_progress_bar_filled_width(
+        bar_args['width'], bar_args['min_value'], bar_args['max_value'],
+        min(max(bar_args['value'], bar_args['min_value']), bar_args['max_value']))
+
+    # Only display the bar if its filled width or its resolved style changed since last time
+    if widget_state_changed(("BAR", bar_args['x'], bar_args['y']), bar_state):
+        display.lcd.DisplayProgressBar(**bar_args)
+        set_widget_state(("BAR", bar_args['x'], bar_args['y']), bar_state)
     
     del tempConfig
 
@@ -474,7 +506,7 @@ class Date:
         if config.THEME_DATA['STATS']['DATE']['DAY']['TEXT'].get("SHOW", False):
             sectionConfig = config.THEME_DATA['STATS']['DATE']['DAY']['TEXT']
             date_format = sectionConfig.get("FORMAT", 'medium')
-            display.lcd.DisplayText(
+            date_args = dict(
                 text=f"{babel.dates.format_date(date_now, format=date_format, locale=lc_time)}",
                 x=sectionConfig.get("X", 0),
                 y=sectionConfig.get("Y", 0),
@@ -484,11 +516,14 @@ class Date:
                 background_color=sectionConfig.get("BACKGROUND_COLOR", config.THEME_DEFAULTS['TEXT_BACKGROUND_COLOR']),
                 background_image=get_full_path(config.THEME_DATA['PATH'], sectionConfig.get("BACKGROUND_IMAGE", config.THEME_DEFAULTS['TEXT_BACKGROUND_IMAGE']))
             )
+            if widget_state_changed(("TEXT", date_args['x'], date_args['y']), date_args):
+                display.lcd.DisplayText(**date_args)
+                set_widget_state(("TEXT", date_args['x'], date_args['y']), date_args)
 
         if config.THEME_DATA['STATS']['DATE']['HOUR']['TEXT'].get("SHOW", False):
             sectionConfig = config.THEME_DATA['STATS']['DATE']['HOUR']['TEXT']
             time_format = sectionConfig.get("FORMAT", 'medium')
-            display.lcd.DisplayText(
+            time_args = dict(
                 text=f"{babel.dates.format_time(date_now, format=time_format, locale=lc_time)}",
                 x=sectionConfig.get("X", 0),
                 y=sectionConfig.get("Y", 0),
@@ -498,3 +533,11 @@ class Date:
                 background_color=sectionConfig.get("BACKGROUND_COLOR", config.THEME_DEFAULTS['TEXT_BACKGROUND_COLOR']),
                 background_image=get_full_path(config.THEME_DATA['PATH'], sectionConfig.get("BACKGROUND_IMAGE", config.THEME_DEFAULTS['TEXT_BACKGROUND_IMAGE']))
             )
+            if widget_state_changed(("TEXT", time_args['x'], time_args['y']), time_args):
+                # Time must be displayed before the next second boundary: it is sent before other pending requests
+                display.lcd.SetRequestDeadline(time.monotonic() + 1 - date_now.microsecond / 1000000)
+                try:
+                    display.lcd.DisplayText(**time_args)
+                finally:
+                    display.lcd.SetRequestDeadline(None)
+                set_widget_state(("TEXT", time_args['x'], time_args['y']), time_args)
@@ -70,7 +70,7 @@ if __name__ == "__main__":
 
         # Do not stop the program now in case data transmission was in progress
         # Instead, ask the scheduler to empty the action queue before stopping
-        scheduler.STOPPING = True
+        scheduler.stop()
 
         # Allow 5 seconds max. delay in case scheduler is not responding
         wait_time = 5
@@ -82,6 +82,13 @@ if __name__ == "__main__":
 
         logger.debug("(%.1fs)" % (5 - wait_time))
 
+        # Cache statistics, to size the caches for the current theme
+        logger.debug("Rendered text cache: %s" % display.lcd.text_cache.cache_info())
+
+        # Effective rates of the periodic jobs, to check if the theme is too heavy for the display link
+        for name, rates in scheduler.get_job_rates().items():
+            logger.debug("Job %s: %s" % (name, rates))
+
         # Remove tray icon just before exit
         if tray_icon:
             tray_icon.visible = False
@@ -199,6 +206,8 @@ if __name__ == "__main__":
     scheduler.DiskStats()
     scheduler.NetStats()
     scheduler.DateStats()
+    if display.lcd.compositor is not None:
+        scheduler.DisplayFlush()
     scheduler.QueueHandler()
 
     if tray_icon and platform.system() == "Darwin":  # macOS-specific
@@ -248,3 +257,6 @@ if __name__ == "__main__":
 
         except Exception as e:
             logger.error("Exception while creating event window: %s" % str(e))
+
+    # In asyncio scheduler mode, the main thread must stay alive for the jobs to run
+    scheduler.join()